@@ -0,0 +1,189 @@
+"""
+Per-provider circuit breaker with rolling error and latency windows.
+
+Each upstream (Pexels search, Pexels CDN, Pollinations.ai) gets its own
+breaker. While a breaker is open, callers skip that provider immediately
+instead of waiting out a timeout. Timeouts adapt from the observed p95
+latency of successful calls, clamped between a floor and the old fixed value.
+
+allow_request() hands out a Permit that the caller passes back to
+record_success/record_failure/record_abandoned. The permit says whether the
+call is the half-open probe and which breaker generation it belongs to, so
+a call that started before the breaker tripped (or closed) can't change its
+state when it finishes late.
+"""
+import threading
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Permit(NamedTuple):
+    generation: int  # bumped every time the breaker trips or closes
+    probe: bool  # True for the single call let through while half-open
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60.0,
+        min_requests: int = 10,
+        error_threshold: float = 0.5,
+        slow_call_seconds: Optional[float] = None,
+        slow_call_threshold: float = 0.5,
+        open_seconds: float = 30.0,
+        min_timeout: float = 1.0,
+        max_timeout: float = 10.0,
+        timeout_multiplier: float = 1.5,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._generation = 0
+        self._calls = deque()  # (timestamp, ok, latency)
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self) -> Optional[Permit]:
+        """Return a Permit if a call to this provider should be attempted now, else None."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return Permit(self._generation, probe=False)
+            if state == HALF_OPEN and not self._probe_in_flight:
+                # Let a single probe through to test recovery
+                self._probe_in_flight = True
+                return Permit(self._generation, probe=True)
+            return None
+
+    def record_success(self, permit: Permit, latency: float):
+        with self._lock:
+            if permit.generation != self._generation:
+                return  # started before the last trip/close; says nothing about now
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                if permit.probe:
+                    self._close(now, latency)
+                return
+            self._calls.append((now, True, latency))
+            self._prune(now)
+            if state == CLOSED:
+                self._evaluate(now)
+
+    def record_failure(self, permit: Permit, latency: float):
+        with self._lock:
+            if permit.generation != self._generation:
+                return
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                if permit.probe:
+                    self._trip(now)
+                return
+            self._calls.append((now, False, latency))
+            self._prune(now)
+            if state == CLOSED:
+                self._evaluate(now)
+
+    def record_abandoned(self, permit: Permit):
+        """The call was cancelled or cut short by the caller; count nothing but free the probe slot."""
+        with self._lock:
+            if permit.probe and permit.generation == self._generation:
+                self._probe_in_flight = False
+
+    def _close(self, now: float, latency: float):
+        self._state = CLOSED
+        self._generation += 1
+        self._probe_in_flight = False
+        self._calls.clear()
+        self._calls.append((now, True, latency))
+
+    def _trip(self, now: float):
+        self._state = OPEN
+        self._generation += 1
+        self._opened_at = now
+        self._probe_in_flight = False
+
+    def _evaluate(self, now: float):
+        total = len(self._calls)
+        if total < self.min_requests:
+            return
+        errors = sum(1 for _, ok, _ in self._calls if not ok)
+        if errors / total >= self.error_threshold:
+            self._trip(now)
+            return
+        if self.slow_call_seconds is not None:
+            slow = sum(1 for _, _, latency in self._calls if latency >= self.slow_call_seconds)
+            if slow / total >= self.slow_call_threshold:
+                self._trip(now)
+
+    def _percentile_locked(self, p: float) -> Optional[float]:
+        latencies = sorted(latency for _, ok, latency in self._calls if ok)
+        if len(latencies) < self.min_requests:
+            return None
+        index = min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Latency percentile of successful calls in the window, or None if too few samples."""
+        with self._lock:
+            self._prune(time.monotonic())
+            return self._percentile_locked(p)
+
+    def timeout(self) -> float:
+        """Adaptive timeout: p95 * multiplier, clamped to [min_timeout, max_timeout]."""
+        p95 = self.percentile(95)
+        if p95 is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.timeout_multiplier))
+
+    def snapshot(self) -> dict:
+        """Current breaker state for monitoring."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            state = self._current_state(now)
+            total = len(self._calls)
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            p50 = self._percentile_locked(50)
+            p95 = self._percentile_locked(95)
+        timeout = self.max_timeout if p95 is None else max(
+            self.min_timeout, min(self.max_timeout, p95 * self.timeout_multiplier)
+        )
+        return {
+            "name": self.name,
+            "state": state,
+            "calls_in_window": total,
+            "error_rate": round(errors / total, 3) if total else 0.0,
+            "p50_latency": p50,
+            "p95_latency": p95,
+            "timeout": round(timeout, 3),
+            "open_for": round(max(0.0, self.open_seconds - (now - self._opened_at)), 1) if state == OPEN else 0.0,
+        }
@@ -0,0 +1,123 @@
+"""
+pytest harness for the backend: a throwaway SQLite database, stubbed
+OpenAI and image providers, and a SQL query counter.
+
+The other test_*.py scripts in this folder drive a running server by hand
+and are not collected. Run with: pip install pytest && pytest
+"""
+import os
+import tempfile
+
+# Must be set before main/database are imported; never point tests at a real DB
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.pop("PROFILING_SECRET", None)
+os.environ.pop("PROFILING_SAMPLE_RATE", None)
+
+from contextlib import contextmanager
+from itertools import count
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+from database import Base, engine
+
+collect_ignore = [
+    "test_complete_flow.py",
+    "test_db.py",
+    "test_fallback.py",
+    "test_image_timing.py",
+    "test_login.py",
+    "test_new_words.py",
+    "test_pexels_integration.py",
+]
+
+_word_ids = count()
+
+
+def make_words(n):
+    words = []
+    for _ in range(n):
+        i = next(_word_ids)
+        words.append({
+            "jp_word": f"言葉{i}",
+            "reading": f"ことば{i}",
+            "romaji": f"kotoba{i}",
+            "english": f"word {i}",
+            "image_search_term": f"thing {i}",
+        })
+    return words
+
+
+class FakeLLM:
+    """Stands in for the batched OpenAI call; returns `words_per_call` fresh words"""
+
+    def __init__(self):
+        self.words_per_call = 3
+        self.calls = 0
+
+    async def generate(self, excluded_words, count=3):
+        self.calls += 1
+        return make_words(self.words_per_call)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(main.word_batcher, "generate", llm.generate)
+    return llm
+
+
+@pytest.fixture
+def fake_images(monkeypatch):
+    """Stub Pexels/Pollinations and keep the prefetch workers from running"""
+    calls = {"fetch": 0, "download": 0, "enqueued": []}
+
+    async def fetch_image(search_term):
+        calls["fetch"] += 1
+        return f"https://images.pexels.com/{search_term.replace(' ', '-')}.jpeg", "Pexels", b"image"
+
+    async def download_image(image_url):
+        calls["download"] += 1
+        return b"image"
+
+    monkeypatch.setattr(main, "fetch_image", fetch_image)
+    monkeypatch.setattr(main, "download_image", download_image)
+    monkeypatch.setattr(main.prefetch_queue, "enqueue", lambda word_ids: calls["enqueued"].extend(word_ids))
+    return calls
+
+
+@pytest.fixture
+def client(fake_llm, fake_images):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def auth_headers(client):
+    response = client.post("/signup", json={"email": "budget@test.com", "password": "test123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def count_queries():
+    """Context manager collecting every SQL statement sent to the engine"""
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return counter
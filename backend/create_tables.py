@@ -3,7 +3,7 @@ Run this script to create all database tables in Supabase
 Usage: python create_tables.py
 """
 from database import engine, Base
-from models import User, Word, UserWord
+from models import User, Word, UserWord, ImageJob, UserStats
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +16,8 @@ try:
     print("  - users")
     print("  - words")
     print("  - user_words")
+    print("  - image_jobs")
+    print("  - user_stats")
 except Exception as e:
     print(f"❌ Error creating tables: {e}")
     import traceback
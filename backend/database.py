@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -19,3 +20,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def insert_ignoring_conflicts(db, model, index_elements):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's database (PostgreSQL or SQLite)"""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing(index_elements=index_elements)
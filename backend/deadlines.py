@@ -0,0 +1,194 @@
+"""
+Per-request deadlines and admission control.
+
+DeadlineMiddleware stamps every request with a deadline
+(REQUEST_DEADLINE_SECONDS, kept under Vercel's maxDuration of 60s). Every
+outbound call derives its timeout from what is left via `bound()`, so one
+slow upstream can't push the request past the platform limit after the
+rest of its work is done. DB statements are refused once the deadline
+has passed.
+
+AdmissionController limits concurrent requests per endpoint class. A request
+is rejected right away with 503 and a Retry-After header, so it fails fast
+instead of slowly, when:
+- the wait queue is full
+- the estimated wait for a slot (recent hold time x queue position) is
+  longer than its time left
+- it would be left with less than ADMISSION_MIN_TIME_LEFT_SECONDS, too
+  little to do its work
+A queued request waits at most ADMISSION_MAX_QUEUE_WAIT_FRACTION of its
+time left before giving up, in case the estimate was optimistic.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import event
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "55"))
+MIN_TIME_LEFT = float(os.getenv("ADMISSION_MIN_TIME_LEFT_SECONDS", "2"))
+MAX_QUEUE_WAIT_FRACTION = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_FRACTION", "0.2"))
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has no time left for further downstream work."""
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None outside a request"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def bound(timeout: float) -> float:
+    """Clamp a downstream timeout to the time left; raise if none is left"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(timeout, left)
+
+
+def set_deadline(seconds: float):
+    return _deadline.set(time.monotonic() + seconds)
+
+
+class DeadlineMiddleware:
+    def __init__(self, app, seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = set_deadline(self.seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+def install_db_deadline_check(engine):
+    """Don't start DB statements for requests that are already past their deadline"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def check_deadline(conn, cursor, statement, parameters, context, executemany):
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded("Request deadline exceeded before DB query")
+
+
+def overloaded(detail: str, retry_after: int) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_queue: int,
+        min_time_left: float = MIN_TIME_LEFT,
+        max_queue_wait_fraction: float = MAX_QUEUE_WAIT_FRACTION,
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.min_time_left = min_time_left
+        self.max_queue_wait_fraction = max_queue_wait_fraction
+        self._semaphore = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._avg_hold = 1.0  # EWMA of seconds a slot is held, for Retry-After
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_deadline": 0}
+
+    def estimated_wait(self) -> float:
+        """Seconds a newly queued request can expect to wait for a slot"""
+        return self._avg_hold * (self._waiting + 1) / self.max_concurrent
+
+    def retry_after(self) -> int:
+        return max(1, min(30, math.ceil(self.estimated_wait())))
+
+    def _reject_late(self, detail: str):
+        self.stats["rejected_deadline"] += 1
+        raise overloaded(detail, self.retry_after())
+
+    async def __call__(self):
+        """FastAPI dependency: hold a slot for the duration of the request"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        left = remaining()
+        if left is not None and left < self.min_time_left:
+            self._reject_late(f"Too little time left for a {self.name} request")
+
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queue:
+                self.stats["rejected_queue_full"] += 1
+                raise overloaded(f"Too many {self.name} requests queued", self.retry_after())
+            max_wait = None
+            if left is not None:
+                if self.estimated_wait() > left - self.min_time_left:
+                    self._reject_late(f"A {self.name} slot won't free up in time")
+                max_wait = left * self.max_queue_wait_fraction
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=max_wait)
+            except asyncio.TimeoutError:
+                self._reject_late(f"Timed out waiting for a {self.name} slot")
+            finally:
+                self._waiting -= 1
+            left = remaining()
+            if left is not None and left < self.min_time_left:
+                self._semaphore.release()
+                self._reject_late(f"Too little time left for a {self.name} request")
+        else:
+            await self._semaphore.acquire()
+
+        self.stats["admitted"] += 1
+        self._in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.monotonic() - start)
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "estimated_wait": round(self.estimated_wait(), 3),
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "retry_after": self.retry_after(),
+            **self.stats,
+        }
+
+
+llm_admission = AdmissionController(
+    "generation",
+    max_concurrent=int(os.getenv("ADMISSION_LLM_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("ADMISSION_LLM_QUEUE", "32")),
+)
+image_admission = AdmissionController(
+    "image",
+    max_concurrent=int(os.getenv("ADMISSION_IMAGE_CONCURRENCY", "32")),
+    max_queue=int(os.getenv("ADMISSION_IMAGE_QUEUE", "64")),
+)
+# Public /images/{id} gets its own slots so anonymous traffic can't starve /generate-image
+public_image_admission = AdmissionController(
+    "public image",
+    max_concurrent=int(os.getenv("ADMISSION_PUBLIC_IMAGE_CONCURRENCY", "32")),
+    max_queue=int(os.getenv("ADMISSION_PUBLIC_IMAGE_QUEUE", "64")),
+)
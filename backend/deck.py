@@ -0,0 +1,191 @@
+"""
+Listing and export of a user's vocabulary deck.
+
+Both walk `user_words JOIN words` ordered by user_words.id:
+- GET /words pages with a keyset cursor (the last user_words.id seen), so
+  deep pages cost the same as the first one, unlike OFFSET
+- GET /words/export streams NDJSON or CSV from a server-side cursor, so
+  memory stays flat no matter how many words the user has
+
+PATCH /words/{id} changes a word's status (and the user's progress counters).
+
+Both accept `fields` to project only the columns the caller needs.
+"""
+import csv
+import io
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+
+import auth
+import stats
+from database import get_db, SessionLocal
+from models import User, Word, UserWord
+
+router = APIRouter()
+
+EXPORT_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024  # flush streamed output in ~64KB chunks
+MAX_PAGE_SIZE = 500
+
+# Public field name -> column
+FIELDS = {
+    "id": UserWord.id,
+    "word_id": Word.id,
+    "jp_word": Word.jp_word,
+    "reading": Word.reading,
+    "romaji": Word.romaji,
+    "english": Word.english,
+    "image_search_term": Word.image_search_term,
+    "status": UserWord.status,
+    "next_review_date": UserWord.next_review_date,
+    "created_at": UserWord.created_at,
+}
+DEFAULT_FIELDS = list(FIELDS)
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return DEFAULT_FIELDS
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def deck_query(user_id: int, names: List[str]):
+    # user_words.id is always selected (last) since it is the cursor
+    columns = [FIELDS[name].label(name) for name in names] + [UserWord.id.label("_cursor")]
+    return (
+        select(*columns)
+        .select_from(UserWord)
+        .join(Word, UserWord.word_id == Word.id)
+        .where(UserWord.user_id == user_id)
+        .order_by(UserWord.id)
+    )
+
+
+def serialize(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def row_to_dict(row, names: List[str]) -> dict:
+    return {name: serialize(getattr(row, name)) for name in names}
+
+
+@router.get("/words")
+def list_words(
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    One page of the user's words. Pass `next_cursor` from the previous
+    response as `cursor` to get the next page; it is null on the last page.
+    """
+    names = parse_fields(fields)
+    stmt = deck_query(current_user.id, names)
+    if cursor is not None:
+        stmt = stmt.where(UserWord.id > cursor)
+    rows = db.execute(stmt.limit(limit + 1)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [row_to_dict(row, names) for row in rows],
+        "next_cursor": rows[-1]._cursor if has_more else None,
+    }
+
+
+def stream_rows(user_id: int, names: List[str]):
+    # Own session: the request's session may be closed before streaming ends
+    db = SessionLocal()
+    try:
+        stmt = deck_query(user_id, names).execution_options(
+            stream_results=True, yield_per=EXPORT_BATCH_SIZE
+        )
+        for row in db.execute(stmt):
+            yield row
+    finally:
+        db.close()
+
+
+def ndjson_lines(user_id: int, names: List[str]):
+    buffer = io.StringIO()
+    for row in stream_rows(user_id, names):
+        buffer.write(json.dumps(row_to_dict(row, names), ensure_ascii=False) + "\n")
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_lines(user_id: int, names: List[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for row in stream_rows(user_id, names):
+        writer.writerow([serialize(getattr(row, name)) for name in names])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@router.get("/words/export")
+def export_words(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fields: Optional[str] = None,
+    current_user: User = Depends(auth.get_current_user)
+):
+    """Stream the user's whole deck as NDJSON or CSV"""
+    names = parse_fields(fields)
+    if format == "csv":
+        return StreamingResponse(
+            csv_lines(current_user.id, names),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="words.csv"'},
+        )
+    return StreamingResponse(
+        ndjson_lines(current_user.id, names),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="words.ndjson"'},
+    )
+
+
+class StatusUpdate(BaseModel):
+    status: str
+
+
+@router.patch("/words/{user_word_id}")
+def update_word_status(
+    user_word_id: int,
+    update: StatusUpdate,
+    current_user: User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Set a word's learning status (new, learning, mastered)"""
+    if update.status not in stats.STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(stats.STATUSES)}")
+    user_word = (
+        db.query(UserWord)
+        .filter(UserWord.id == user_word_id, UserWord.user_id == current_user.id)
+        .first()
+    )
+    if not user_word:
+        raise HTTPException(status_code=404, detail="Word not found")
+
+    stats.set_status(db, user_word, update.status)
+    result = {"id": user_word.id, "status": user_word.status}  # read before commit expires them
+    db.commit()
+    return result
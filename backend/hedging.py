@@ -0,0 +1,140 @@
+"""
+Hedged requests: if the primary hasn't answered within a latency percentile,
+start the secondary too and take whichever usable result arrives first.
+
+Hedges are paid for out of a token bucket that earns `max_hedge_ratio` tokens
+per request, so hedging can never add more than that fraction of extra load
+upstream (plus a small burst).
+"""
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_hedge_ratio: float = 0.1,
+        burst: float = 5.0,
+        window: int = 200,
+        min_samples: int = 20,
+        default_delay: float = 2.0,
+    ):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+
+        self._latencies = deque(maxlen=window)
+        self._tokens = burst
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def record_latency(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> float:
+        """Seconds to wait on the primary before hedging."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.default_delay
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(round(self.percentile / 100.0 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def on_request(self):
+        with self._lock:
+            self._requests += 1
+            self._tokens = min(self.burst, self._tokens + self.max_hedge_ratio)
+
+    def try_acquire(self) -> bool:
+        """Take a hedge token; False if the hedge budget is spent."""
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            self._hedges += 1
+            return True
+
+    def record_hedge_win(self):
+        with self._lock:
+            self._hedge_wins += 1
+
+    def snapshot(self) -> dict:
+        delay = self.delay()
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "hedge_rate": round(self._hedges / self._requests, 3) if self._requests else 0.0,
+                "delay": round(delay, 3),
+                "tokens": round(self._tokens, 2),
+            }
+
+
+def _result_or_none(task: "asyncio.Task") -> Optional[T]:
+    if task.cancelled() or task.exception() is not None:
+        return None
+    return task.result()
+
+
+async def hedged(
+    primary: Callable[[], Awaitable[Optional[T]]],
+    secondary: Callable[[], Awaitable[Optional[T]]],
+    policy: HedgePolicy,
+) -> Optional[T]:
+    """
+    Run `primary`; if it hasn't finished after `policy.delay()`, also start
+    `secondary` (budget permitting). A result of None or an exception counts
+    as unusable. The first usable result wins and the other task is cancelled.
+    If the primary finishes unusable before the delay, `secondary` runs as a
+    plain fallback. Exceptions from `secondary` propagate when nothing usable
+    was produced.
+    """
+    policy.on_request()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    primary_task = asyncio.ensure_future(primary())
+
+    secondary_task = None
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=policy.delay())
+        if not done and policy.try_acquire():
+            secondary_task = asyncio.ensure_future(secondary())
+            pending = {primary_task, secondary_task}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = _result_or_none(task)
+                    if result is None:
+                        continue
+                    if task is primary_task:
+                        policy.record_latency(loop.time() - start)
+                    else:
+                        policy.record_hedge_win()
+                    return result
+            # Neither produced a usable result; surface the secondary's error if any
+            if secondary_task.exception() is not None:
+                raise secondary_task.exception()
+            return None
+
+        # Not hedging (primary finished in time or budget is spent)
+        await asyncio.wait({primary_task})
+        result = _result_or_none(primary_task)
+        if result is not None:
+            policy.record_latency(loop.time() - start)
+            return result
+        return await secondary()
+    finally:
+        for task in (primary_task, secondary_task):
+            if task is not None and not task.done():
+                task.cancel()
@@ -0,0 +1,232 @@
+"""
+Image provider chain: Pexels stock photos first, Pollinations.ai as fallback.
+
+Every upstream call goes through a circuit breaker (see circuit_breaker.py),
+so while a provider is degraded we fall back right away instead of waiting
+out its timeout on every request. With IMAGE_HEDGING=true, a slow Pexels
+lookup is hedged with a Pollinations.ai request (see hedging.py).
+"""
+import os
+import time
+import logging
+from typing import Optional, Tuple
+
+import httpx
+
+from circuit_breaker import CircuitBreaker
+from hedging import HedgePolicy, hedged
+from deadlines import DeadlineExceeded, bound
+
+logger = logging.getLogger("uvicorn")
+
+PEXELS = "pexels"
+POLLINATIONS = "pollinations"
+
+
+class ProviderUnavailable(Exception):
+    """Raised when every provider that could serve an image is unavailable."""
+
+
+def _breaker(name: str, max_timeout: float, slow_call_seconds: float) -> CircuitBreaker:
+    prefix = f"BREAKER_{name.upper()}_"
+    return CircuitBreaker(
+        name=name,
+        window_seconds=float(os.getenv(prefix + "WINDOW_SECONDS", "60")),
+        min_requests=int(os.getenv(prefix + "MIN_REQUESTS", "10")),
+        error_threshold=float(os.getenv(prefix + "ERROR_THRESHOLD", "0.5")),
+        slow_call_seconds=float(os.getenv(prefix + "SLOW_CALL_SECONDS", str(slow_call_seconds))),
+        open_seconds=float(os.getenv(prefix + "OPEN_SECONDS", "30")),
+        max_timeout=max_timeout,
+    )
+
+
+# Search API and image downloads are tracked separately: Pexels search being
+# slow says nothing about its CDN, and Pollinations only has a download step.
+breakers = {
+    "pexels_search": _breaker("pexels_search", max_timeout=10.0, slow_call_seconds=5.0),
+    "pexels_cdn": _breaker("pexels_cdn", max_timeout=30.0, slow_call_seconds=10.0),
+    "pollinations": _breaker("pollinations", max_timeout=30.0, slow_call_seconds=20.0),
+}
+
+
+HEDGING_ENABLED = os.getenv("IMAGE_HEDGING", "false").lower() == "true"
+hedge_policy = HedgePolicy(
+    percentile=float(os.getenv("IMAGE_HEDGE_PERCENTILE", "95")),
+    max_hedge_ratio=float(os.getenv("IMAGE_HEDGE_MAX_RATIO", "0.1")),
+)
+
+
+def provider_for_url(image_url: str) -> str:
+    return POLLINATIONS if "pollinations.ai" in image_url else PEXELS
+
+
+def _download_breaker(image_url: str) -> CircuitBreaker:
+    if provider_for_url(image_url) == POLLINATIONS:
+        return breakers["pollinations"]
+    return breakers["pexels_cdn"]
+
+
+def breaker_status() -> dict:
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+def hedge_status() -> dict:
+    return {"enabled": HEDGING_ENABLED, **hedge_policy.snapshot()}
+
+
+async def fetch_image_from_pexels(search_term: str) -> Optional[str]:
+    """
+    Fetch image URL from Pexels API (fast, free stock photos)
+    Returns the image URL if found, None otherwise
+    """
+    pexels_api_key = os.getenv("PEXELS_API_KEY")
+    if not pexels_api_key:
+        logger.warning("PEXELS_API_KEY not set in .env file")
+        return None
+
+    breaker = breakers["pexels_search"]
+    limit = breaker.timeout()
+    timeout = bound(limit)
+    permit = breaker.allow_request()
+    if not permit:
+        logger.info(f"⏭️ Pexels breaker open, skipping search for '{search_term}'")
+        return None
+
+    start = time.monotonic()
+    try:
+        headers = {"Authorization": pexels_api_key}
+        url = f"https://api.pexels.com/v1/search?query={search_term}&per_page=1&orientation=square"
+
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.get(url, headers=headers)
+            response.raise_for_status()
+            data = response.json()
+        breaker.record_success(permit, time.monotonic() - start)
+
+        if data.get("photos") and len(data["photos"]) > 0:
+            # Get medium-sized image (faster download)
+            image_url = data["photos"][0]["src"]["medium"]
+            logger.info(f"✓ Found Pexels image for '{search_term}'")
+            return image_url
+        else:
+            logger.info(f"✗ No Pexels image found for '{search_term}'")
+            return None
+    except httpx.TimeoutException as e:
+        if timeout < limit:
+            # Cut short by the request deadline, not the provider's fault
+            breaker.record_abandoned(permit)
+            raise DeadlineExceeded(f"Request deadline exceeded during Pexels search: {e}")
+        breaker.record_failure(permit, time.monotonic() - start)
+        logger.warning(f"Pexels API timeout for '{search_term}': {e}")
+        return None
+    except Exception as e:
+        breaker.record_failure(permit, time.monotonic() - start)
+        logger.warning(f"Pexels API error for '{search_term}': {e}")
+        return None
+    except BaseException:
+        # Cancelled, e.g. the losing side of a hedged request
+        breaker.record_abandoned(permit)
+        raise
+
+
+async def generate_image_with_pollinations(search_term: str) -> str:
+    """
+    Generate image using Pollinations.ai (fallback)
+    Returns the image URL
+    """
+    prompt = f"a simple clear photo of {search_term}"
+    image_url = f"https://image.pollinations.ai/prompt/{prompt.replace(' ', '%20')}?width=512&height=512&nologo=true"
+    logger.info(f"🎨 Generating image with Pollinations.ai for '{search_term}'")
+    return image_url
+
+
+async def download_image(image_url: str) -> bytes:
+    """
+    Download image bytes through the breaker for the URL's provider.
+    Raises ProviderUnavailable if the breaker is open, DeadlineExceeded if
+    the request runs out of time.
+    """
+    breaker = _download_breaker(image_url)
+    limit = breaker.timeout()
+    timeout = bound(limit)
+    permit = breaker.allow_request()
+    if not permit:
+        raise ProviderUnavailable(f"{breaker.name} circuit is open")
+
+    start = time.monotonic()
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            img_response = await client.get(image_url)
+            img_response.raise_for_status()
+    except httpx.TimeoutException as e:
+        if timeout < limit:
+            breaker.record_abandoned(permit)
+            raise DeadlineExceeded(f"Request deadline exceeded during image download: {e}")
+        breaker.record_failure(permit, time.monotonic() - start)
+        raise
+    except Exception:
+        breaker.record_failure(permit, time.monotonic() - start)
+        raise
+    except BaseException:
+        breaker.record_abandoned(permit)
+        raise
+    breaker.record_success(permit, time.monotonic() - start)
+    return img_response.content
+
+
+async def _from_pexels(search_term: str) -> Optional[Tuple[str, str, bytes]]:
+    image_url = await fetch_image_from_pexels(search_term)
+    if not image_url:
+        return None
+    try:
+        return image_url, "Pexels", await download_image(image_url)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Pexels image download failed for '{search_term}': {e}, falling back")
+        return None
+
+
+async def _from_pollinations(search_term: str) -> Tuple[str, str, bytes]:
+    image_url = await generate_image_with_pollinations(search_term)
+    return image_url, "Pollinations.ai", await download_image(image_url)
+
+
+async def resolve_image_url(search_term: str) -> Tuple[str, str]:
+    """
+    Find the image URL for a search term without downloading a Pexels
+    image; for background resolution, where the bytes would be thrown away.
+    Returns (image_url, source).
+
+    Pollinations.ai renders an image on its first request, so its URL is
+    downloaded once on purpose: that warms it, and a failure here means the
+    URL isn't worth caching.
+    """
+    image_url = await fetch_image_from_pexels(search_term)
+    if image_url:
+        return image_url, "Pexels"
+    image_url, source, _ = await _from_pollinations(search_term)
+    return image_url, source
+
+
+async def fetch_image(search_term: str) -> Tuple[str, str, bytes]:
+    """
+    Resolve and download an image for a search term.
+    Returns (image_url, source, content).
+
+    Tries Pexels first; on a miss, an open breaker or a failed download,
+    falls back to Pollinations.ai. When hedging is enabled and Pexels is
+    slower than its usual percentile, Pollinations.ai is started in parallel
+    and the first usable image wins.
+    """
+    if HEDGING_ENABLED:
+        return await hedged(
+            lambda: _from_pexels(search_term),
+            lambda: _from_pollinations(search_term),
+            hedge_policy,
+        )
+
+    result = await _from_pexels(search_term)
+    if result:
+        return result
+    return await _from_pollinations(search_term)
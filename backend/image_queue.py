@@ -0,0 +1,208 @@
+"""
+Background image pre-resolution.
+
+When /generate links new words to a user, their images are resolved in the
+background so the URL is already cached on Word.image_path by the time the
+client asks /generate-image for the card.
+
+- Bounded concurrency: a fixed number of worker tasks drain an asyncio queue
+- Dedup: a word is only queued once per process, and once in image_jobs
+- Retries: a failed lookup is queued again with exponential backoff until
+  it has failed IMAGE_PREFETCH_MAX_ATTEMPTS times
+- Durable fallback: every job is written to image_jobs first and deleted on
+  success. Jobs dropped by a full queue or left by a recycled process are
+  picked up at startup and by a periodic sweep of image_jobs
+"""
+import asyncio
+import contextvars
+import os
+import logging
+from typing import Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, insert_ignoring_conflicts
+from models import Word, ImageJob
+from image_providers import resolve_image_url
+
+logger = logging.getLogger("uvicorn")
+
+CONCURRENCY = int(os.getenv("IMAGE_PREFETCH_CONCURRENCY", "4"))
+QUEUE_SIZE = int(os.getenv("IMAGE_PREFETCH_QUEUE_SIZE", "1000"))
+MAX_ATTEMPTS = int(os.getenv("IMAGE_PREFETCH_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.getenv("IMAGE_PREFETCH_RETRY_BASE_SECONDS", "30"))
+SWEEP_INTERVAL = int(os.getenv("IMAGE_PREFETCH_SWEEP_SECONDS", "300"))
+
+
+class ImagePrefetchQueue:
+    def __init__(self, concurrency: int = CONCURRENCY, maxsize: int = QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self._queue = None
+        self._workers: List[asyncio.Task] = []
+        self._queued = set()  # queued, in progress or waiting to be retried
+        self._retries = {}  # word_id -> TimerHandle
+        self.stats = {"enqueued": 0, "deduped": 0, "dropped": 0, "resolved": 0, "failed": 0, "retried": 0}
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        # Fresh context: workers outlive the request that happens to start them
+        loop = asyncio.get_running_loop()
+        self._workers = [
+            loop.create_task(self._worker(), context=contextvars.Context())
+            for _ in range(self.concurrency)
+        ]
+
+    def enqueue(self, word_ids: Iterable[int]):
+        """Queue word ids in memory (must be called from the event loop)."""
+        self._ensure_started()
+        for word_id in word_ids:
+            if word_id in self._queued:
+                self.stats["deduped"] += 1
+                continue
+            try:
+                self._queue.put_nowait(word_id)
+            except asyncio.QueueFull:
+                # Still in image_jobs; picked up by the next sweep
+                self.stats["dropped"] += 1
+                continue
+            self._queued.add(word_id)
+            self.stats["enqueued"] += 1
+
+    def add_jobs(self, db: Session, words: Iterable[Word]) -> List[int]:
+        """
+        Persist jobs for words without a cached image in the caller's
+        transaction (one statement, does not commit). Returns their ids;
+        enqueue() them once the transaction has committed.
+        """
+        word_ids = [w.id for w in words if not w.image_path]
+        if word_ids:
+            db.execute(
+                insert_ignoring_conflicts(db, ImageJob, ["word_id"]),
+                [{"word_id": word_id} for word_id in word_ids],
+            )
+        return word_ids
+
+    def schedule(self, db: Session, words: Iterable[Word]):
+        """Persist jobs for words without a cached image, then queue them."""
+        word_ids = self.add_jobs(db, words)
+        if word_ids:
+            db.commit()
+            self.enqueue(word_ids)
+
+    @staticmethod
+    def _pending_jobs(limit: int) -> List[int]:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(ImageJob.word_id)
+                .filter(ImageJob.attempts < MAX_ATTEMPTS)
+                .order_by(ImageJob.created_at)
+                .limit(limit)
+                .all()
+            )
+        finally:
+            db.close()
+        return [row.word_id for row in rows]
+
+    def recover(self, limit: int = 500):
+        """Re-queue jobs left in image_jobs by a previous process."""
+        word_ids = self._pending_jobs(limit)
+        if word_ids:
+            logger.info(f"Recovering {len(word_ids)} pending image jobs")
+            self.enqueue(word_ids)
+
+    async def sweep_periodically(self, limit: int = 500):
+        """Re-queue jobs that were dropped by a full queue (already queued ones are deduped)"""
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                word_ids = await asyncio.to_thread(self._pending_jobs, limit)
+                if word_ids:
+                    self.enqueue(word_ids)
+            except Exception as e:
+                logger.warning(f"Image job sweep failed: {e}")
+
+    def _retry_later(self, word_id: int, attempts: int):
+        # Stays in _queued while waiting, so sweeps and new schedules don't double it up
+        delay = RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        loop = asyncio.get_running_loop()
+        self._retries[word_id] = loop.call_later(delay, self._retry, word_id)
+
+    def _retry(self, word_id: int):
+        self._retries.pop(word_id, None)
+        self._queued.discard(word_id)
+        self.stats["retried"] += 1
+        self.enqueue([word_id])
+
+    async def _worker(self):
+        while True:
+            word_id = await self._queue.get()
+            failed_attempts = None
+            try:
+                failed_attempts = await self._resolve(word_id)
+            except Exception as e:
+                logger.warning(f"Image prefetch worker error for word {word_id}: {e}")
+            finally:
+                self._queue.task_done()
+                if failed_attempts is not None and failed_attempts < MAX_ATTEMPTS:
+                    self._retry_later(word_id, failed_attempts)
+                else:
+                    self._queued.discard(word_id)
+
+    async def _resolve(self, word_id: int) -> Optional[int]:
+        """Resolve one job. Returns the job's attempt count if the lookup failed."""
+        db = SessionLocal()
+        try:
+            job = db.get(ImageJob, word_id)
+            word = db.get(Word, word_id)
+            if word is None or word.image_path:
+                # Already resolved (e.g. by /generate-image) or gone
+                if job:
+                    db.delete(job)
+                    db.commit()
+                return
+
+            try:
+                image_url, source = await resolve_image_url(word.image_search_term or word.english)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"Image prefetch failed for {word.jp_word}: {e}")
+                if job is None:
+                    return None
+                job.attempts = (job.attempts or 0) + 1
+                job.last_error = str(e)[:500]
+                db.commit()
+                return job.attempts
+
+            word.image_path = image_url
+            if job:
+                db.delete(job)
+            db.commit()
+            self.stats["resolved"] += 1
+            logger.info(f"🖼️ Prefetched image for {word.jp_word} from {source}")
+        finally:
+            db.close()
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "depth": self._queue.qsize() if self._queue else 0,
+            "waiting_to_retry": len(self._retries),
+            **self.stats,
+        }
+
+    async def stop(self):
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queued.clear()
+
+
+prefetch_queue = ImagePrefetchQueue()
@@ -0,0 +1,291 @@
+"""
+Cross-user micro-batching of word generation.
+
+Concurrent /generate calls are collected for a short window (or until the
+batch is full) and served by a single, larger chat completion. The words
+that come back are split among the waiting users, each filtered against
+that user's known words. Every prompt lists each of its users' known words
+in full: users are only grouped while their combined exclusions stay under
+LLM_BATCH_MAX_EXCLUDED, and a user with a larger deck gets a completion of
+their own. This trades a few milliseconds of latency for far
+fewer OpenAI requests at peak, where we hit the request-count rate limit.
+
+Every item is validated on its own. Malformed items are dropped, and a
+user who ends up short gets a small follow-up request for just the missing
+count, instead of the whole request failing and being retried.
+"""
+import asyncio
+import json
+import os
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+from pydantic import ValidationError
+
+import deadlines
+
+logger = logging.getLogger("uvicorn")
+
+MAX_BATCH_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("LLM_BATCH_MAX_WAIT_MS", "50"))
+MAX_EXCLUDED = int(os.getenv("LLM_BATCH_MAX_EXCLUDED", "200"))
+MAX_REPAIRS = int(os.getenv("LLM_MAX_REPAIR_CALLS", "1"))
+
+
+def build_prompt(count: int, excluded_words: List[str]) -> str:
+    return f"""
+        Generate {count} beginner Japanese words that are NOT in this list: {excluded_words}.
+        For each word, provide:
+        - jp_word: The word in Japanese (Kanji/Kana)
+        - reading: The reading in Hiragana/Katakana
+        - romaji: The reading in Romaji
+        - english: The English meaning
+        - image_search_term: A simple English search term to find an image for this word (e.g. "apple" for "ringo")
+
+        Return ONLY a JSON object with a key "words" containing the list of objects.
+        """
+
+
+@dataclass
+class _Waiter:
+    excluded: Set[str]
+    count: int
+    future: "asyncio.Future"
+    deadline: Optional[float]  # time.monotonic() value, None without a request deadline
+
+
+class WordBatcher:
+    def __init__(
+        self,
+        complete: Callable[[str, Optional[float]], str],
+        schema: type,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+        max_excluded: int = MAX_EXCLUDED,
+        max_repairs: int = MAX_REPAIRS,
+    ):
+        """
+        `complete(prompt, timeout)` returns the model's raw JSON content;
+        timeout is None when no waiter has a deadline. Each returned item
+        is validated against the pydantic model `schema`.
+        """
+        self.complete = complete
+        self.schema = schema
+        self.max_repairs = max_repairs
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_excluded = max_excluded
+        self._pending: List[_Waiter] = []
+        self._timer = None
+        self._tasks = set()  # running completions, referenced so they aren't garbage collected
+        self.stats = {
+            "batches": 0,
+            "requests": 0,
+            "errors": 0,
+            "words_requested": 0,
+            "words_generated": 0,
+            "words_delivered": 0,
+            "generations": 0,
+            "malformed_responses": 0,
+            "items_received": 0,
+            "items_invalid": 0,
+            "repair_calls": 0,
+            "words_repaired": 0,
+            "short_after_repair": 0,
+        }
+
+    async def generate(self, excluded_words: List[str], count: int = 3) -> List[dict]:
+        """
+        Get up to `count` new, validated word dicts for a user who already
+        knows `excluded_words`. Fewer are returned only if repairs run out.
+        """
+        self.stats["generations"] += 1
+        words = await self._request(set(excluded_words), count)
+        repairs = 0
+        while len(words) < count and repairs < self.max_repairs:
+            repairs += 1
+            self.stats["repair_calls"] += 1
+            excluded = set(excluded_words) | {w["jp_word"] for w in words}
+            more = await self._request(excluded, count - len(words))
+            self.stats["words_repaired"] += len(more)
+            words += more
+        if len(words) < count:
+            self.stats["short_after_repair"] += 1
+        return words
+
+    async def _request(self, excluded: Set[str], count: int) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        left = deadlines.remaining()
+        if left is not None and left <= 0:
+            raise deadlines.DeadlineExceeded("Request deadline exceeded before word generation")
+        waiter = _Waiter(
+            excluded=excluded,
+            count=count,
+            future=loop.create_future(),
+            deadline=None if left is None else time.monotonic() + left,
+        )
+        self._pending.append(waiter)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        try:
+            # Shielded: giving up on our share must not cancel the batch for the others
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout=left)
+        except asyncio.TimeoutError:
+            raise deadlines.DeadlineExceeded("Request deadline exceeded during word generation")
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        for group in self._groups(batch):
+            task = asyncio.ensure_future(self._run(group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _groups(self, batch: List[_Waiter]) -> List[List[_Waiter]]:
+        """
+        Split a flushed batch into completions whose prompts can list every
+        waiter's known words in full. Waiters share a completion while their
+        combined exclusions fit in max_excluded; a waiter over the cap on
+        its own is served alone, as it would be without batching.
+        """
+        groups, current, excluded = [], [], set()
+        for waiter in batch:
+            if len(waiter.excluded) > self.max_excluded:
+                groups.append([waiter])
+                continue
+            combined = excluded | waiter.excluded
+            if current and len(combined) > self.max_excluded:
+                groups.append(current)
+                current, combined = [], set(waiter.excluded)
+            current.append(waiter)
+            excluded = combined
+        if current:
+            groups.append(current)
+        return groups
+
+    def _prompt_for(self, batch: List[_Waiter]) -> str:
+        requested = sum(w.count for w in batch)
+        if len(batch) == 1:
+            return build_prompt(requested, sorted(batch[0].excluded))
+
+        # Over-generate so per-user filtering still leaves enough for everyone
+        total = requested + max(2, requested // 2)
+        excluded = set().union(*(w.excluded for w in batch))
+        return build_prompt(total, sorted(excluded))
+
+    @staticmethod
+    def _timeout_for(batch: List[_Waiter]) -> Optional[float]:
+        # Serve the waiter with the most time left; the others stop waiting on their own
+        if any(w.deadline is None for w in batch):
+            return None
+        return max(0.0, max(w.deadline for w in batch) - time.monotonic())
+
+    async def _run(self, batch: List[_Waiter]):
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        self.stats["words_requested"] += sum(w.count for w in batch)
+
+        try:
+            # The OpenAI client is blocking; keep the event loop free to collect the next batch
+            content = await asyncio.to_thread(self.complete, self._prompt_for(batch), self._timeout_for(batch))
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Batched word generation failed for {len(batch)} requests: {e}")
+            for waiter in batch:
+                if not waiter.future.done():
+                    waiter.future.set_exception(e)
+            return
+
+        try:
+            unique = self._valid_words(content)
+            self.stats["words_generated"] += len(unique)
+            shares = self._split(batch, unique)
+        except Exception as e:
+            # Every waiter must still be answered; an empty share goes to repair
+            self.stats["errors"] += 1
+            logger.warning(f"Could not split generated words for {len(batch)} requests: {e}")
+            shares = [[] for _ in batch]
+
+        for waiter, assigned in zip(batch, shares):
+            self.stats["words_delivered"] += len(assigned)
+            if not waiter.future.done():
+                waiter.future.set_result(assigned)
+
+    def _valid_words(self, content: Optional[str]) -> List[dict]:
+        """
+        Parse the model output and keep only items that match the schema.
+        A response that isn't valid JSON, or has no content at all (e.g. a
+        refusal), yields no words (the waiters' follow-up requests cover
+        it) rather than an error.
+        """
+        try:
+            items = json.loads(content).get("words", [])
+            if not isinstance(items, list):
+                raise ValueError("'words' is not a list")
+        except (ValueError, AttributeError, TypeError) as e:
+            self.stats["malformed_responses"] += 1
+            logger.warning(f"Malformed word generation response: {e}")
+            return []
+
+        self.stats["items_received"] += len(items)
+        # Drop invalid items and duplicates the model sometimes returns within one response
+        valid, seen = [], set()
+        for item in items:
+            try:
+                word = self.schema.model_validate(item).model_dump()
+            except ValidationError as e:
+                self.stats["items_invalid"] += 1
+                logger.info(f"Dropping invalid generated word {item!r}: {e.error_count()} errors")
+                continue
+            if not word["jp_word"].strip() or word["jp_word"] in seen:
+                self.stats["items_invalid"] += 1
+                continue
+            seen.add(word["jp_word"])
+            valid.append(word)
+        return valid
+
+    @staticmethod
+    def _split(batch: List[_Waiter], words: List[dict]) -> List[List[dict]]:
+        """
+        Give each waiter words it doesn't already know, preferring words no
+        other waiter in the batch got; shared words only fill remaining gaps.
+        """
+        assigned = [[] for _ in batch]
+        taken = set()
+        for distinct_only in (True, False):
+            for i, waiter in enumerate(batch):
+                have = {w.get("jp_word") for w in assigned[i]}
+                for w in words:
+                    if len(assigned[i]) >= waiter.count:
+                        break
+                    key = w.get("jp_word")
+                    if key in waiter.excluded or key in have:
+                        continue
+                    if distinct_only and id(w) in taken:
+                        continue
+                    assigned[i].append(w)
+                    have.add(key)
+                    taken.add(id(w))
+        return assigned
+
+    def snapshot(self) -> dict:
+        batches = self.stats["batches"]
+        received = self.stats["items_received"]
+        return {
+            "item_failure_rate": round(self.stats["items_invalid"] / received, 3) if received else 0.0,
+            "repair_rate": round(self.stats["repair_calls"] / self.stats["generations"], 3) if self.stats["generations"] else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "pending": len(self._pending),
+            "avg_batch_size": round(self.stats["requests"] / batches, 2) if batches else 0.0,
+            "avg_batch_fill": round(self.stats["requests"] / (batches * self.max_batch_size), 3) if batches else 0.0,
+            **self.stats,
+        }
@@ -1,18 +1,29 @@
-from fastapi import FastAPI, HTTPException, Depends, Response
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Depends, Response, Query, Header
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Dict, Optional
 import os
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
-import json
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from database import engine, get_db, Base
+from database import engine, get_db, Base, insert_ignoring_conflicts
 from models import User, Word, UserWord
 import auth
-import httpx
+import deck
+import stats
+import profiling
+import deadlines
+from deadlines import DeadlineExceeded
+from image_providers import fetch_image, download_image, breaker_status, hedge_status, ProviderUnavailable
+from image_queue import prefetch_queue
+from llm_batcher import WordBatcher
+from contextlib import asynccontextmanager
+import asyncio
+import math
 import time
+import hashlib
 import logging
 
 logger = logging.getLogger("uvicorn")
@@ -23,7 +34,22 @@ load_dotenv()
 # Don't create tables on every cold start in serverless environment
 # Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up image jobs a previous (possibly recycled) process didn't finish
+    try:
+        prefetch_queue.recover()
+    except Exception as e:
+        logger.warning(f"Could not recover pending image jobs: {e}")
+    reconcile_task = asyncio.create_task(stats.reconcile_periodically())
+    sweep_task = asyncio.create_task(prefetch_queue.sweep_periodically())
+    yield
+    reconcile_task.cancel()
+    sweep_task.cancel()
+    await prefetch_queue.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS - Allow all origins for deployment testing
 app.add_middleware(
@@ -34,10 +60,91 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Every request gets a deadline that bounds its downstream timeouts
+app.add_middleware(deadlines.DeadlineMiddleware)
+deadlines.install_db_deadline_check(engine)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(RateLimitError)
+async def rate_limited_handler(request, exc: RateLimitError):
+    # OpenAI's limit, not the caller's: tell them when to come back
+    retry_after = str(math.ceil(openai_retry_after(exc) or 5))
+    return JSONResponse(status_code=503, content={"detail": "Word generation is rate limited, try again shortly"},
+                        headers={"Retry-After": retry_after})
+
+
 app.include_router(auth.router)
+app.include_router(deck.router)
+app.include_router(stats.router)
+
+# Opt-in profiling; nothing is installed unless PROFILING_SECRET/PROFILING_SAMPLE_RATE is set
+if profiling.enabled():
+    profiling.install_sql_logging(engine)
+    app.add_middleware(profiling.ProfilingMiddleware)
+    app.include_router(profiling.router)
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MIN_ATTEMPT_SECONDS = 3.0  # don't start a retry with less time than this left
+
+
+def openai_retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the API asked us to wait (Retry-After header), if any"""
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def complete_json(prompt: str, timeout: Optional[float] = None) -> str:
+    """
+    Run a word generation prompt and return the model's raw JSON content.
+
+    Without a timeout the SDK's own retries apply. With one (the requests'
+    time left), rate limits, 5xx and connection errors are retried here
+    with backoff, but only while a fresh attempt still fits in the time
+    left: the SDK's timeout is per attempt, so its retries could run past it.
+    Blocking; runs in a worker thread.
+    """
+    if timeout is None:
+        return _create_completion(client, prompt)
+
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        left = deadline - time.monotonic()
+        try:
+            return _create_completion(client.with_options(timeout=left, max_retries=0), prompt)
+        except APITimeoutError as e:
+            # The timeout was the requests' remaining time, so they ran out of it: 503, not 500
+            raise DeadlineExceeded(f"Request deadline exceeded during word generation: {e}")
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            attempt += 1
+            delay = openai_retry_after(e) or min(8.0, 0.5 * 2 ** (attempt - 1))
+            if attempt > LLM_MAX_RETRIES or deadline - time.monotonic() - delay < LLM_MIN_ATTEMPT_SECONDS:
+                raise
+            logger.info(f"Retrying word generation in {delay:.1f}s after: {e}")
+            time.sleep(delay)
+
+
+def _create_completion(llm: OpenAI, prompt: str) -> str:
+    response = llm.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a helpful Japanese language teacher. Output valid JSON only."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"}
+    )
+    return response.choices[0].message.content
+
 class GenerateRequest(BaseModel):
     pass # No longer need excluded_words from client
 
@@ -51,132 +158,175 @@ class WordResponse(BaseModel):
 class GenerateResponse(BaseModel):
     words: List[WordResponse]
 
-@app.post("/generate", response_model=GenerateResponse)
+
+# Generated items are validated one by one against WordResponse
+word_batcher = WordBatcher(complete_json, WordResponse)
+
+
+async def link_new_words(current_user: User, db: Session):
+    """
+    Generate new words for the user, store and link them, and queue their images.
+    Returns (word dicts, Word rows) in the same order.
+    """
+    # Get the words the user already has (one joined query)
+    excluded_words_list = [
+        row.jp_word for row in
+        db.query(Word.jp_word).join(UserWord, UserWord.word_id == Word.id).filter(UserWord.user_id == current_user.id).all()
+    ]
+
+    # Batched with other users' concurrent requests into one completion
+    new_words_data = await word_batcher.generate(excluded_words_list, count=3)
+
+    # Bulk-insert every returned word, skipping ones that already exist or
+    # that a concurrent request (often in the same batch) is inserting right
+    # now, then load them all: two statements however many words there are
+    jp_words = [w_data["jp_word"] for w_data in new_words_data]
+    known = {}
+    if jp_words:
+        db.execute(insert_ignoring_conflicts(db, Word, ["jp_word"]), [
+            {
+                "jp_word": w_data["jp_word"],
+                "reading": w_data["reading"],
+                "romaji": w_data["romaji"],
+                "english": w_data["english"],
+                "image_search_term": w_data["image_search_term"],
+            }
+            for w_data in new_words_data
+        ])
+        known = {w.jp_word: w for w in db.query(Word).filter(Word.jp_word.in_(jp_words)).all()}
+
+    response_words = list(new_words_data)
+    linked_words = [known[w_data["jp_word"]] for w_data in new_words_data]
+
+    # Link to user
+    if linked_words:
+        db.execute(insert(UserWord), [{"user_id": current_user.id, "word_id": w.id} for w in linked_words])
+
+    # Progress counters and image jobs go in the same transaction as the new links
+    stats.adjust(db, current_user.id, {"new": len(linked_words)})
+    job_ids = prefetch_queue.add_jobs(db, linked_words)
+    # The words were just read in this transaction; building the response
+    # from them shouldn't cost a reload query per row
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = True
+
+    # Start resolving images now so they're cached before the cards are shown
+    try:
+        prefetch_queue.enqueue(job_ids)
+    except Exception as e:
+        logger.warning(f"Could not queue image prefetch: {e}")
+
+    return response_words, linked_words
+
+
+@app.post("/generate", response_model=GenerateResponse, dependencies=[Depends(deadlines.llm_admission)])
 async def generate_words(
     request: GenerateRequest, 
     current_user: User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
-        # Get words the user already has
-        user_words = db.query(UserWord).filter(UserWord.user_id == current_user.id).all()
-        excluded_word_ids = [uw.word_id for uw in user_words]
-        
-        # Get actual word strings to exclude
-        existing_words = db.query(Word).filter(Word.id.in_(excluded_word_ids)).all()
-        excluded_words_list = [w.jp_word for w in existing_words]
-
-        prompt = f"""
-        Generate 3 beginner Japanese words that are NOT in this list: {excluded_words_list}.
-        For each word, provide:
-        - jp_word: The word in Japanese (Kanji/Kana)
-        - reading: The reading in Hiragana/Katakana
-        - romaji: The reading in Romaji
-        - english: The English meaning
-        - image_search_term: A simple English search term to find an image for this word (e.g. "apple" for "ringo")
-        
-        Return ONLY a JSON object with a key "words" containing the list of objects.
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful Japanese language teacher. Output valid JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-
-        content = response.choices[0].message.content
-        data = json.loads(content)
-        
-        new_words_data = data.get("words", [])
-        response_words = []
-
-        for w_data in new_words_data:
-            # Check if word exists in global DB, if not create it
-            db_word = db.query(Word).filter(Word.jp_word == w_data["jp_word"]).first()
-            if not db_word:
-                db_word = Word(
-                    jp_word=w_data["jp_word"],
-                    reading=w_data["reading"],
-                    romaji=w_data["romaji"],
-                    english=w_data["english"],
-                    image_search_term=w_data["image_search_term"]
-                )
-                db.add(db_word)
-                db.commit()
-                db.refresh(db_word)
-            
-            # Link to user
-            user_word = UserWord(user_id=current_user.id, word_id=db_word.id)
-            db.add(user_word)
-            db.commit()
-            
-            response_words.append(w_data)
-
+        response_words, _ = await link_new_words(current_user, db)
         return {"words": response_words}
 
+    except (DeadlineExceeded, RateLimitError):
+        raise
     except Exception as e:
         print(f"Error generating words: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-
 @app.get("/")
 def read_root():
     return {"message": "Japanese Learning API is running"}
 
 
+@app.get("/status/providers")
+def provider_status():
+    """Circuit breaker and hedging state for the image providers (for monitoring)"""
+    return {**breaker_status(), "hedging": hedge_status()}
+
+
+@app.get("/status/llm-batcher")
+def llm_batcher_status():
+    """Word generation batching counters (batch fill, words generated vs delivered)"""
+    return word_batcher.snapshot()
+
+
+@app.get("/status/admission")
+def admission_status():
+    """Concurrency slots, queue depth and rejections per endpoint class"""
+    return {
+        "generation": deadlines.llm_admission.snapshot(),
+        "image": deadlines.image_admission.snapshot(),
+        "public_image": deadlines.public_image_admission.snapshot(),
+    }
+
+
+@app.get("/status/image-queue")
+def image_queue_status():
+    """Background image pre-resolution queue depth and counters"""
+    return prefetch_queue.snapshot()
+
+
 class ImageGenerateRequest(BaseModel):
     word: str
     english_meaning: str
 
 
-async def fetch_image_from_pexels(search_term: str) -> str:
+def has_cached_image(db_word: Word) -> bool:
+    # Check if cached path is a valid URL (not an old file path)
+    return bool(db_word and db_word.image_path and (db_word.image_path.startswith('http://') or db_word.image_path.startswith('https://')))
+
+
+async def load_word_image(db: Session, db_word: Word, word: str, search_term: str) -> bytes:
     """
-    Fetch image URL from Pexels API (fast, free stock photos)
-    Returns the image URL if found, None otherwise
+    Get image bytes for a word:
+    1. Use the cached image URL from the database if we have one
+    2. Otherwise try Pexels, falling back to Pollinations.ai, and cache the URL
     """
-    pexels_api_key = os.getenv("PEXELS_API_KEY")
-    if not pexels_api_key:
-        logger.warning("PEXELS_API_KEY not set in .env file")
-        return None
+    start_time = time.time()
+
+    if has_cached_image(db_word):
+        # Return cached image URL by fetching and streaming it
+        logger.info(f"⚡ CACHE HIT: Using cached image URL for {word}")
+
+        try:
+            # Fetch the cached image and return it
+            return await download_image(db_word.image_path)
+        except DeadlineExceeded:
+            raise
+        except ProviderUnavailable as e:
+            # Provider is tripped, not the URL; keep the cache and fall back below
+            logger.warning(f"Cached image provider unavailable for {word}: {e}")
+        except Exception as e:
+            # If cached URL fails, clear it and generate new one
+            logger.warning(f"Cached image URL failed for {word}: {e}, generating new one")
+            db_word.image_path = None
+            db.commit()
 
-    try:
-        headers = {"Authorization": pexels_api_key}
-        url = f"https://api.pexels.com/v1/search?query={search_term}&per_page=1&orientation=square"
-
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get("photos") and len(data["photos"]) > 0:
-                # Get medium-sized image (faster download)
-                image_url = data["photos"][0]["src"]["medium"]
-                logger.info(f"✓ Found Pexels image for '{search_term}'")
-                return image_url
-            else:
-                logger.info(f"✗ No Pexels image found for '{search_term}'")
-                return None
-    except Exception as e:
-        logger.warning(f"Pexels API error for '{search_term}': {e}")
-        return None
+    logger.info(f"🔍 Fetching new image for {word} ({search_term})")
 
+    # Pexels first, Pollinations.ai on a miss or while Pexels' breaker is open
+    fetch_start = time.time()
+    image_url, source, content = await fetch_image(search_term)
 
-async def generate_image_with_pollinations(search_term: str) -> str:
-    """
-    Generate image using Pollinations.ai (fallback)
-    Returns the image URL
-    """
-    prompt = f"a simple clear photo of {search_term}"
-    image_url = f"https://image.pollinations.ai/prompt/{prompt.replace(' ', '%20')}?width=512&height=512&nologo=true"
-    logger.info(f"🎨 Generating image with Pollinations.ai for '{search_term}'")
-    return image_url
+    fetch_time = time.time() - fetch_start
+    total_time = time.time() - start_time
+    logger.info(f"✅ Image from {source} fetched in {fetch_time:.2f}s, total time: {total_time:.2f}s")
+
+    # Cache the image URL in database (not the file, just the URL)
+    if db_word:
+        db_word.image_path = image_url  # Store URL instead of file path
+        db.commit()
+
+    return content
 
 
-@app.post("/generate-image")
+@app.post("/generate-image", dependencies=[Depends(deadlines.image_admission)])
 async def generate_word_image(
     request: ImageGenerateRequest,
     current_user: User = Depends(auth.get_current_user),
@@ -192,67 +342,136 @@ async def generate_word_image(
     so we cache URLs in database and stream images directly
     """
     try:
-        start_time = time.time()
-
         # Check if we already have a cached image URL for this word
         db_word = db.query(Word).filter(Word.jp_word == request.word).first()
-
-        # Check if cached path is a valid URL (not an old file path)
-        if db_word and db_word.image_path and (db_word.image_path.startswith('http://') or db_word.image_path.startswith('https://')):
-            # Return cached image URL by fetching and streaming it
-            logger.info(f"⚡ CACHE HIT: Using cached image URL for {request.word}")
-
-            try:
-                # Fetch the cached image and return it
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    img_response = await client.get(db_word.image_path)
-                    img_response.raise_for_status()
-
-                    return Response(
-                        content=img_response.content,
-                        media_type="image/png",
-                        headers={"Content-Disposition": f'inline; filename="{request.english_meaning}.png"'}
-                    )
-            except Exception as e:
-                # If cached URL fails, clear it and generate new one
-                logger.warning(f"Cached image URL failed for {request.word}: {e}, generating new one")
-                db_word.image_path = None
-                db.commit()
-
-        logger.info(f"🔍 Fetching new image for {request.word} ({request.english_meaning})")
-
-        # Try Pexels API first (fast stock photos)
-        image_url = await fetch_image_from_pexels(request.english_meaning)
-        source = "Pexels"
-
-        # Fallback to AI generation if no stock photo found
-        if not image_url:
-            image_url = await generate_image_with_pollinations(request.english_meaning)
-            source = "Pollinations.ai"
-
-        # Fetch the image and stream it to client
-        fetch_start = time.time()
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            img_response = await client.get(image_url)
-            img_response.raise_for_status()
-
-        fetch_time = time.time() - fetch_start
-        total_time = time.time() - start_time
-        logger.info(f"✅ Image from {source} fetched in {fetch_time:.2f}s, total time: {total_time:.2f}s")
-
-        # Cache the image URL in database (not the file, just the URL)
-        if db_word:
-            db_word.image_path = image_url  # Store URL instead of file path
-            db.commit()
+        content = await load_word_image(db, db_word, request.word, request.english_meaning)
 
         return Response(
-            content=img_response.content,
+            content=content,
             media_type="image/png",
             headers={"Content-Disposition": f'inline; filename="{request.english_meaning}.png"'}
         )
+    except ProviderUnavailable as e:
+        logger.warning(f"No image provider available for {request.word}: {e}")
+        raise HTTPException(status_code=503, detail=f"Image providers unavailable: {str(e)}")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         logger.error(f"Error getting image for {request.word}: {e}")
         logger.error(f"Full traceback: {error_details}")
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+
+
+class CardImage(BaseModel):
+    status: str  # "ready" (cached, cheap to load) or "pending" (still being resolved)
+    url: str
+    etag: Optional[str] = None
+
+class Card(WordResponse):
+    word_id: int
+    image: CardImage
+
+class CardsResponse(BaseModel):
+    cards: List[Card]
+
+class CardImagesResponse(BaseModel):
+    images: Dict[int, CardImage]
+
+
+def image_etag(image_url: str) -> str:
+    # The cached upstream URL identifies the image, so it doubles as its version
+    return '"' + hashlib.sha1(image_url.encode()).hexdigest()[:16] + '"'
+
+
+def card_image(db_word: Word) -> CardImage:
+    url = f"/images/{db_word.id}"
+    if has_cached_image(db_word):
+        return CardImage(status="ready", url=url, etag=image_etag(db_word.image_path))
+    return CardImage(status="pending", url=url)
+
+
+@app.post("/cards", response_model=CardsResponse, dependencies=[Depends(deadlines.llm_admission)])
+async def generate_cards(
+    current_user: User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Generate new words together with their image handles, so one request
+    replaces /generate plus a /generate-image call per word. Images that
+    aren't resolved yet are marked pending; poll /cards/images for them.
+    """
+    try:
+        response_words, linked_words = await link_new_words(current_user, db)
+        cards = [
+            Card(**w_data, word_id=db_word.id, image=card_image(db_word))
+            for w_data, db_word in zip(response_words, linked_words)
+        ]
+        return {"cards": cards}
+
+    except (DeadlineExceeded, RateLimitError):
+        raise
+    except Exception as e:
+        logger.error(f"Error generating cards: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+MAX_CARD_IMAGE_IDS = 50
+
+
+@app.get("/cards/images", response_model=CardImagesResponse)
+def get_card_images(word_ids: List[int] = Query(..., max_length=MAX_CARD_IMAGE_IDS), db: Session = Depends(get_db)):
+    """
+    Cheap poll for pending card images: one query, no upstream calls.
+    Images are shared across users, so this needs no auth.
+    """
+    words = db.query(Word).filter(Word.id.in_(word_ids)).all()
+    return {"images": {w.id: card_image(w) for w in words}}
+
+
+@app.get("/images/{word_id}", dependencies=[Depends(deadlines.public_image_admission)])
+async def get_image(
+    word_id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Serve a word's cached image with an ETag so browsers and CDNs can
+    revalidate without re-downloading.
+
+    This is public (it's used as an <img> src), so it never searches the
+    providers: walking /images/1..N must not spend the Pexels quota. Images
+    that aren't resolved yet return 404; the background queue resolves them
+    and /cards/images reports when they're ready.
+    """
+    db_word = db.query(Word).filter(Word.id == word_id).first()
+    if not db_word:
+        raise HTTPException(status_code=404, detail="Word not found")
+    if not has_cached_image(db_word):
+        raise HTTPException(status_code=404, detail="Image not resolved yet", headers={"Retry-After": "2"})
+
+    cache_headers = {"Cache-Control": "public, max-age=86400"}
+    etag = image_etag(db_word.image_path)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={**cache_headers, "ETag": etag})
+
+    try:
+        content = await download_image(db_word.image_path)
+    except ProviderUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Image providers unavailable: {str(e)}")
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        # The cached URL went bad; drop it and let the background queue find a new one
+        logger.warning(f"Cached image URL failed for word {word_id}: {e}, re-queueing")
+        db_word.image_path = None
+        db.commit()
+        prefetch_queue.schedule(db, [db_word])
+        raise HTTPException(status_code=404, detail="Image not resolved yet", headers={"Retry-After": "2"})
+
+    return Response(
+        content=content,
+        media_type="image/png",
+        headers={**cache_headers, "ETag": etag}
+    )
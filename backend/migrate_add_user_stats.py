@@ -0,0 +1,35 @@
+"""
+Migration script to add the user_stats table (per-user progress counters)
+and the (user_id, status, next_review_date) index on user_words, then
+backfill the counters from user_words
+Run this once to update existing database
+"""
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv()
+
+from database import engine
+from models import UserStats
+from stats import reconcile_all
+
+def migrate():
+    print("Creating user_stats table if missing...")
+    UserStats.__table__.create(bind=engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        print("Creating ix_user_words_user_id_status_next_review_date index on user_words...")
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_user_words_user_id_status_next_review_date "
+            "ON user_words (user_id, status, next_review_date)"
+        ))
+        # Superseded by the index above (created by earlier versions of this script)
+        conn.execute(text("DROP INDEX IF EXISTS ix_user_words_user_id_next_review_date"))
+        conn.commit()
+
+    print("Backfilling counters...")
+    reconcile_all()
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,27 @@
+"""
+Migration script to add the (user_id, id) index on user_words used for
+keyset pagination of a user's deck (GET /words, GET /words/export)
+Run this once to update existing database
+"""
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+load_dotenv()
+
+def migrate():
+    SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
+    if not SQLALCHEMY_DATABASE_URL:
+        print("Error: DATABASE_URL not found in environment")
+        return
+
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+    with engine.connect() as conn:
+        print("Creating ix_user_words_user_id_id index on user_words...")
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_words_user_id_id ON user_words (user_id, id)"))
+        conn.commit()
+        print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate()
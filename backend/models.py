@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -10,7 +10,8 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     
-    words = relationship("UserWord", back_populates="user")
+    # lazy="raise": a deck can be tens of thousands of rows, use deck.py to list it
+    words = relationship("UserWord", back_populates="user", lazy="raise")
 
 class Word(Base):
     __tablename__ = "words"
@@ -37,3 +38,30 @@ class UserWord(Base):
 
     user = relationship("User", back_populates="words")
     word = relationship("Word", back_populates="user_associations")
+
+    # Keyset pagination over a user's deck (see deck.py)
+    __table_args__ = (
+        Index("ix_user_words_user_id_id", "user_id", "id"),
+        # Due-today counts for the stats endpoint (see stats.py); status is in
+        # the index so the count never has to visit the table rows
+        Index("ix_user_words_user_id_status_next_review_date", "user_id", "status", "next_review_date"),
+    )
+
+class ImageJob(Base):
+    """Durable record of a pending background image resolution (see image_queue.py)"""
+    __tablename__ = "image_jobs"
+
+    word_id = Column(Integer, ForeignKey("words.id"), primary_key=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class UserStats(Base):
+    """Per-user progress counters, kept in step with user_words (see stats.py)"""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    new_count = Column(Integer, default=0, nullable=False)
+    learning_count = Column(Integer, default=0, nullable=False)
+    mastered_count = Column(Integer, default=0, nullable=False)
+    reconciled_at = Column(DateTime, nullable=True)
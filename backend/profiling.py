@@ -0,0 +1,228 @@
+"""
+Opt-in request profiling for production hot paths.
+
+A request is profiled when it carries a valid admin-signed X-Profile-Token
+header, or when it is picked by PROFILING_SAMPLE_RATE. For each profiled
+request we store:
+- a cProfile dump (<id>.prof), wall-clock by default, CPU time with
+  `X-Profile-Mode: cpu`
+- a JSON summary (<id>.json) with wall/CPU totals, the top functions and a
+  SQL log (every statement with its duration, plus counts per statement)
+
+Both can be downloaded from /profiles (admin token required). The response
+gets an X-Profile-Id header pointing at them.
+
+Nothing is installed unless PROFILING_SECRET or PROFILING_SAMPLE_RATE is
+set, so the overhead is zero when disabled. cProfile follows the event loop
+thread, so other requests running concurrently on the loop show up in the
+profile too, and only one request is profiled at a time.
+
+Generate a token with: python profiling.py
+"""
+import asyncio
+import cProfile
+import contextvars
+import hashlib
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+import logging
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy import event
+
+logger = logging.getLogger("uvicorn")
+
+load_dotenv()
+
+SECRET = os.getenv("PROFILING_SECRET", "")
+SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILING_DIR", "/tmp/profiles")  # /tmp is the only writable path on Vercel
+MAX_PROFILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+TOKEN_MAX_AGE = 300  # seconds
+
+router = APIRouter()
+
+_queries: contextvars.ContextVar = contextvars.ContextVar("profiling_queries", default=None)
+_profiling_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(SECRET) or SAMPLE_RATE > 0
+
+
+def make_token(secret: str = SECRET, timestamp: Optional[int] = None) -> str:
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), str(timestamp).encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}:{signature}"
+
+
+def verify_token(token: Optional[str]) -> bool:
+    if not SECRET or not token or ":" not in token:
+        return False
+    timestamp, _ = token.split(":", 1)
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > TOKEN_MAX_AGE:
+        return False
+    return hmac.compare_digest(token, make_token(SECRET, int(timestamp)))
+
+
+def install_sql_logging(engine):
+    """Record every statement run while a profiled request is active"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _queries.get() is not None:
+            context._profiling_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries = _queries.get()
+        if queries is not None and hasattr(context, "_profiling_start"):
+            queries.append((statement, time.perf_counter() - context._profiling_start))
+
+
+def _summarize_queries(queries) -> dict:
+    by_statement = {}
+    for statement, duration in queries:
+        entry = by_statement.setdefault(statement, {"statement": statement, "count": 0, "total_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += duration * 1000
+    return {
+        "count": len(queries),
+        "total_ms": round(sum(d for _, d in queries) * 1000, 3),
+        "by_statement": sorted(
+            ({**e, "total_ms": round(e["total_ms"], 3)} for e in by_statement.values()),
+            key=lambda e: e["total_ms"],
+            reverse=True,
+        ),
+        "log": [{"statement": s, "ms": round(d * 1000, 3)} for s, d in queries],
+    }
+
+
+def _prune_old_profiles():
+    files = sorted(
+        (os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith(".json")),
+        key=os.path.getmtime,
+    )
+    for path in files[:-MAX_PROFILES]:
+        for ext in (".json", ".prof"):
+            try:
+                os.remove(path[: -len(".json")] + ext)
+            except OSError:
+                pass
+
+
+def _save(profile_id: str, profiler: cProfile.Profile, summary: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+
+    top = io.StringIO()
+    pstats.Stats(profiler, stream=top).sort_stats("cumulative").print_stats(30)
+    summary["top_functions"] = top.getvalue()
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    _prune_old_profiles()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/profiles"):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-profile-token")
+        triggered = verify_token(token.decode() if token else None) or (
+            SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+        )
+        # cProfile can only follow one request at a time
+        if not triggered or not _profiling_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        mode = "cpu" if headers.get(b"x-profile-mode") == b"cpu" else "wall"
+        profile_id = uuid.uuid4().hex[:12]
+        status = {}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        queries = []
+        queries_token = _queries.set(queries)
+        profiler = cProfile.Profile(time.thread_time if mode == "cpu" else time.perf_counter)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            _queries.reset(queries_token)
+            _profiling_lock.release()
+            summary = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status.get("code"),
+                "mode": mode,
+                "wall_ms": round((time.perf_counter() - wall_start) * 1000, 3),
+                "cpu_ms": round((time.process_time() - cpu_start) * 1000, 3),
+                "sql": _summarize_queries(queries),
+            }
+            try:
+                # pstats formatting and file writes would block the event loop
+                await asyncio.to_thread(_save, profile_id, profiler, summary)
+                logger.info(f"📈 Profiled {scope['method']} {scope['path']} as {profile_id}")
+            except Exception as e:
+                logger.warning(f"Could not save profile {profile_id}: {e}")
+
+
+def _require_admin(token: Optional[str]):
+    if not verify_token(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+@router.get("/profiles")
+def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    _require_admin(x_profile_token)
+    if not os.path.isdir(PROFILE_DIR):
+        return {"profiles": []}
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR)):
+        if name.endswith(".json"):
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                summary = json.load(f)
+            profiles.append({k: summary.get(k) for k in ("id", "method", "path", "status", "mode", "wall_ms", "cpu_ms")})
+    return {"profiles": profiles}
+
+
+@router.get("/profiles/{filename}")
+def download_profile(filename: str, x_profile_token: Optional[str] = Header(None)):
+    """Download <id>.json (summary and SQL log) or <id>.prof (load with pstats/snakeviz)"""
+    _require_admin(x_profile_token)
+    profile_id, _, ext = filename.rpartition(".")
+    if ext not in ("json", "prof") or not profile_id.isalnum():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    path = os.path.join(PROFILE_DIR, filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=filename)
+
+
+if __name__ == "__main__":
+    if not SECRET:
+        print("Error: PROFILING_SECRET not set in environment")
+    else:
+        print(make_token())
@@ -0,0 +1,204 @@
+"""
+Per-user progress counters.
+
+user_stats holds one row per user with a counter per word status. The
+counters are adjusted in the same transaction that inserts a UserWord or
+changes its status, so GET /stats reads a single row instead of running
+COUNT ... GROUP BY over the whole deck. A periodic reconciliation job
+recounts from user_words and fixes any drift.
+"""
+import asyncio
+import datetime
+import os
+import logging
+from typing import Dict
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import auth
+from database import get_db, SessionLocal
+from models import User, UserWord, UserStats
+
+logger = logging.getLogger("uvicorn")
+
+router = APIRouter()
+
+STATUSES = ("new", "learning", "mastered")
+COUNTERS = {
+    "new": UserStats.new_count,
+    "learning": UserStats.learning_count,
+    "mastered": UserStats.mastered_count,
+}
+RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+RECONCILE_BATCH_SIZE = 500
+
+
+def count_statuses(db: Session, user_id: int) -> Dict[str, int]:
+    """Recount a user's words per status straight from user_words"""
+    rows = (
+        db.query(UserWord.status, func.count(UserWord.id))
+        .filter(UserWord.user_id == user_id)
+        .group_by(UserWord.status)
+        .all()
+    )
+    counts = {status: 0 for status in STATUSES}
+    for status, count in rows:
+        if status in counts:
+            counts[status] = count
+    return counts
+
+
+def _values(counts: Dict[str, int]) -> dict:
+    return {COUNTERS[status].key: counts[status] for status in STATUSES}
+
+
+def adjust(db: Session, user_id: int, deltas: Dict[str, int]):
+    """
+    Apply counter deltas in the caller's transaction (does not commit).
+    Call after the matching UserWord change has been added to the session.
+    """
+    values = {COUNTERS[s]: COUNTERS[s] + d for s, d in deltas.items() if d and s in COUNTERS}
+    if not values:
+        return
+    updated = (
+        db.query(UserStats)
+        .filter(UserStats.user_id == user_id)
+        .update(values, synchronize_session=False)
+    )
+    if updated:
+        return
+
+    # No row yet (new user, or one from before user_stats existed): count
+    # everything, including the pending change, instead of trusting deltas
+    db.flush()
+    try:
+        with db.begin_nested():
+            db.add(UserStats(user_id=user_id, **_values(count_statuses(db, user_id))))
+    except IntegrityError:
+        # Another request created the row first; apply our deltas to it
+        db.query(UserStats).filter(UserStats.user_id == user_id).update(values, synchronize_session=False)
+
+
+def set_status(db: Session, user_word: UserWord, status: str):
+    """Change a word's status and its counters together (does not commit)"""
+    if status not in STATUSES:
+        raise ValueError(f"Unknown status: {status}")
+    old_status = user_word.status
+    if old_status == status:
+        return
+    user_word.status = status
+    adjust(db, user_word.user_id, {old_status: -1, status: 1})
+
+
+def reconcile_user(db: Session, user_id: int) -> bool:
+    """
+    Overwrite a user's counters with a fresh count (does not commit; commit
+    promptly, the stats row stays locked until then). Returns True if they
+    had drifted.
+
+    The row is locked before counting, so a concurrent adjust() either
+    committed before the count (and is included in it) or waits for our
+    commit and applies its delta on top. Counting first would let us
+    overwrite its delta with a stale count.
+    """
+    row = (
+        db.query(UserStats)
+        .filter(UserStats.user_id == user_id)
+        .with_for_update()
+        .populate_existing()
+        .one_or_none()
+    )
+    counts = count_statuses(db, user_id)
+    now = datetime.datetime.utcnow()
+    if row is None:
+        try:
+            with db.begin_nested():
+                db.add(UserStats(user_id=user_id, reconciled_at=now, **_values(counts)))
+        except IntegrityError:
+            # adjust() created the row meanwhile, from its own full count
+            return False
+        return True
+    drifted = any(getattr(row, COUNTERS[s].key) != counts[s] for s in STATUSES)
+    for key, value in _values(counts).items():
+        setattr(row, key, value)
+    row.reconciled_at = now
+    return drifted
+
+
+def reconcile_all() -> int:
+    """Reconcile every user in batches. Returns the number of users that had drifted."""
+    drifted = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            user_ids = [
+                row.id for row in
+                db.query(User.id).filter(User.id > last_id).order_by(User.id).limit(RECONCILE_BATCH_SIZE).all()
+            ]
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                # One short transaction per user, so no stats row stays locked for long
+                if reconcile_user(db, user_id):
+                    drifted += 1
+                db.commit()
+            last_id = user_ids[-1]
+    finally:
+        db.close()
+    return drifted
+
+
+async def reconcile_periodically():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            drifted = await asyncio.to_thread(reconcile_all)
+            if drifted:
+                logger.warning(f"Stats reconciliation fixed drift for {drifted} users")
+        except Exception as e:
+            logger.warning(f"Stats reconciliation failed: {e}")
+
+
+def due_count_query(user_id: int, until: datetime.datetime):
+    # count(*) rather than count(id): id isn't in the index, so it would need the table rows
+    return (
+        select(func.count())
+        .select_from(UserWord)
+        .where(
+            UserWord.user_id == user_id,
+            UserWord.status.in_(("new", "learning")),  # not !=, so it's a range on the index
+            UserWord.next_review_date <= until,
+        )
+    )
+
+
+@router.get("/stats")
+def get_stats(current_user: User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    """
+    Progress counters for the dashboard: one row read plus the due count.
+
+    due_today depends on the clock, so it isn't a counter. It is counted from
+    the (user_id, status, next_review_date) index alone (an index-only scan
+    on PostgreSQL), but it still costs one index entry per due, unmastered
+    word. Mastered and future-dated words are skipped; a large backlog of
+    never-reviewed words (due the moment they're generated) is not.
+    """
+    row = db.get(UserStats, current_user.id)
+    if row is None:
+        reconcile_user(db, current_user.id)
+        db.commit()
+        row = db.get(UserStats, current_user.id)
+
+    end_of_today = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.max)
+    due_today = db.execute(due_count_query(current_user.id, end_of_today)).scalar()
+    return {
+        "new": row.new_count,
+        "learning": row.learning_count,
+        "mastered": row.mastered_count,
+        "total": row.new_count + row.learning_count + row.mastered_count,
+        "due_today": due_today,
+    }
@@ -0,0 +1,35 @@
+"""
+Public card image endpoints: they serve what's cached and never call the
+image providers on behalf of anonymous clients.
+"""
+import deadlines
+import main
+from main import MAX_CARD_IMAGE_IDS
+
+
+def test_walking_image_ids_does_not_reach_the_providers(client, auth_headers, fake_llm, fake_images):
+    fake_llm.words_per_call = 5
+    cards = client.post("/cards", headers=auth_headers).json()["cards"]
+
+    for word_id in range(1, cards[-1]["word_id"] + 5):
+        assert client.get(f"/images/{word_id}").status_code == 404
+
+    assert fake_images["fetch"] == 0
+    assert fake_images["download"] == 0
+
+
+def test_card_image_poll_is_capped(client):
+    ids = list(range(1, MAX_CARD_IMAGE_IDS + 2))
+    assert client.get("/cards/images", params={"word_ids": ids[:-1]}).status_code == 200
+    assert client.get("/cards/images", params={"word_ids": ids}).status_code == 422
+
+
+def admission_for(path, method):
+    route = next(r for r in main.app.routes if getattr(r, "path", None) == path and method in r.methods)
+    return [d.dependency for d in route.dependencies]
+
+
+def test_public_images_have_their_own_admission_slots():
+    # Anonymous /images traffic must not queue up authenticated /generate-image requests
+    assert admission_for("/images/{word_id}", "GET") == [deadlines.public_image_admission]
+    assert admission_for("/generate-image", "POST") == [deadlines.image_admission]
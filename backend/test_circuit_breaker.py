@@ -0,0 +1,142 @@
+"""
+Circuit breaker state transitions and adaptive timeouts, driven by a fake clock.
+"""
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def succeed(breaker, latency=0.1):
+    breaker.record_success(breaker.allow_request(), latency)
+
+
+def fail(breaker, latency=0.1):
+    breaker.record_failure(breaker.allow_request(), latency)
+
+
+def make_breaker(**kwargs):
+    options = dict(name="test", window_seconds=60, min_requests=4, error_threshold=0.5, open_seconds=30)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_trips_on_error_rate_and_recovers_through_a_single_probe(clock):
+    breaker = make_breaker()
+    for _ in range(2):
+        succeed(breaker, 0.1)
+    fail(breaker, 0.1)
+    assert breaker.snapshot()["state"] == CLOSED
+    fail(breaker, 0.1)
+    assert breaker.snapshot()["state"] == OPEN
+    assert not breaker.allow_request()
+
+    clock.now += 30
+    assert breaker.snapshot()["state"] == HALF_OPEN
+    probe = breaker.allow_request()
+    assert probe.probe
+    assert not breaker.allow_request(), "only one probe at a time"
+
+    breaker.record_success(probe, 0.1)
+    assert breaker.snapshot()["state"] == CLOSED
+    assert breaker.allow_request()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        fail(breaker, 0.1)
+    clock.now += 30
+    probe = breaker.allow_request()
+    breaker.record_failure(probe, 0.1)
+
+    assert breaker.snapshot()["state"] == OPEN
+    assert not breaker.allow_request()
+
+
+def tripped(clock):
+    """A breaker that just opened, plus a permit handed out before it did"""
+    breaker = make_breaker()
+    early = breaker.allow_request()
+    for _ in range(4):
+        fail(breaker)
+    return breaker, early
+
+
+def test_abandoning_an_ordinary_call_does_not_free_the_probe(clock):
+    breaker, early = tripped(clock)
+    clock.now += 30
+    probe = breaker.allow_request()
+
+    breaker.record_abandoned(early)
+    assert not breaker.allow_request(), "a second probe got through"
+
+    breaker.record_abandoned(probe)
+    assert breaker.allow_request()
+
+
+def test_late_success_from_before_the_trip_does_not_close(clock):
+    breaker, early = tripped(clock)
+    clock.now += 30
+    breaker.allow_request()
+
+    breaker.record_success(early, 0.1)
+    assert breaker.snapshot()["state"] == HALF_OPEN
+
+
+def test_late_failures_do_not_extend_the_open_period(clock):
+    breaker, early = tripped(clock)
+    clock.now += 20
+    breaker.record_failure(early, 0.1)
+
+    clock.now += 10
+    assert breaker.snapshot()["state"] == HALF_OPEN
+
+
+def test_trips_on_slow_calls(clock):
+    breaker = make_breaker(slow_call_seconds=5.0)
+    for _ in range(4):
+        succeed(breaker, 6.0)
+    assert breaker.snapshot()["state"] == OPEN
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        fail(breaker, 0.1)
+    clock.now += 61
+    fail(breaker, 0.1)
+    assert breaker.snapshot()["state"] == CLOSED
+
+
+def test_timeout_follows_p95_within_bounds(clock):
+    breaker = make_breaker(min_timeout=1.0, max_timeout=10.0, timeout_multiplier=1.5)
+    assert breaker.timeout() == 10.0  # no samples yet
+
+    for _ in range(4):
+        succeed(breaker, 2.0)
+    assert breaker.timeout() == 3.0
+
+    for _ in range(4):
+        succeed(breaker, 0.1)
+    assert breaker.timeout() == 3.0  # p95 still the slow calls
+
+    fast = make_breaker(min_timeout=1.0)
+    for _ in range(4):
+        succeed(fast, 0.1)
+    assert fast.timeout() == 1.0
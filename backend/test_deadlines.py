@@ -0,0 +1,210 @@
+"""
+Request deadlines and admission control: downstream timeouts are clamped to
+the time left, running out of it is a 503 rather than a 500, and a full
+admission queue rejects right away with Retry-After.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from openai import APITimeoutError, RateLimitError
+
+import deadlines
+import main
+from deadlines import AdmissionController, DeadlineExceeded, bound, set_deadline
+from llm_batcher import WordBatcher
+
+
+@pytest.fixture
+def deadline():
+    tokens = []
+
+    def set_(seconds):
+        tokens.append(set_deadline(seconds))
+
+    yield set_
+    for token in reversed(tokens):
+        deadlines._deadline.reset(token)
+
+
+def test_bound_clamps_to_the_time_left(deadline):
+    assert bound(10.0) == 10.0  # outside a request
+
+    deadline(2.0)
+    assert 1.9 < bound(10.0) <= 2.0
+    assert bound(0.5) == 0.5
+
+    deadline(-1.0)
+    with pytest.raises(DeadlineExceeded):
+        bound(10.0)
+
+
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+
+
+def rate_limited(retry_after="0"):
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=httpx.Request("POST", OPENAI_URL))
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class ScriptedClient:
+    """Stands in for the OpenAI client: raises or answers per attempt, records timeouts"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.timeouts = []
+        self.chat = self
+        self.completions = self
+
+    def with_options(self, timeout=None, max_retries=None):
+        assert max_retries == 0
+        self.timeouts.append(timeout)
+        return self
+
+    def create(self, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))])
+
+
+def TimingOutLLM():
+    return ScriptedClient(*[APITimeoutError(request=httpx.Request("POST", OPENAI_URL))] * 5)
+
+
+def test_llm_timeout_from_the_deadline_is_a_deadline_error(monkeypatch):
+    llm = TimingOutLLM()
+    monkeypatch.setattr(main, "client", llm)
+
+    with pytest.raises(DeadlineExceeded):
+        main.complete_json("prompt", timeout=3.0)
+    assert len(llm.timeouts) == 1 and 2.9 < llm.timeouts[0] <= 3.0
+
+    # Without a deadline it's an ordinary upstream timeout
+    monkeypatch.setattr(main, "client", TimingOutLLM())
+    with pytest.raises(APITimeoutError):
+        main.complete_json("prompt")
+
+
+def test_rate_limit_is_retried_within_the_deadline(monkeypatch):
+    llm = ScriptedClient(rate_limited(), rate_limited(), '{"words": []}')
+    monkeypatch.setattr(main, "client", llm)
+
+    assert main.complete_json("prompt", timeout=30.0) == '{"words": []}'
+    assert len(llm.timeouts) == 3
+    assert llm.timeouts[0] >= llm.timeouts[1] >= llm.timeouts[2]
+
+
+def test_rate_limit_is_not_retried_past_the_deadline(monkeypatch):
+    llm = ScriptedClient(rate_limited(retry_after="10"), '{"words": []}')
+    monkeypatch.setattr(main, "client", llm)
+
+    start = time.monotonic()
+    with pytest.raises(RateLimitError):
+        main.complete_json("prompt", timeout=5.0)
+    assert time.monotonic() - start < 0.5
+    assert len(llm.timeouts) == 1
+
+
+def test_rate_limit_is_a_503_with_retry_after(client, auth_headers, monkeypatch):
+    async def generate(excluded_words, count=3):
+        raise rate_limited(retry_after="7")
+
+    monkeypatch.setattr(main.word_batcher, "generate", generate)
+    for path in ("/generate", "/cards"):
+        response = client.post(path, json={}, headers=auth_headers)
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "7"
+
+
+def test_batched_generation_gets_a_clamped_timeout_and_reports_503(monkeypatch, deadline):
+    llm = TimingOutLLM()
+    monkeypatch.setattr(main, "client", llm)
+    batcher = WordBatcher(main.complete_json, main.WordResponse, max_batch_size=1)
+
+    deadline(5.0)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(batcher.generate([], 3))
+    assert 0 < llm.timeouts[0] <= 5.0
+
+
+async def admit(controller):
+    """Enter the admission dependency; returns the generator holding the slot"""
+    slot = controller()
+    await slot.__anext__()
+    return slot
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def run():
+        controller = AdmissionController("test", max_concurrent=1, max_queue=1)
+        holder = await admit(controller)
+        queued = asyncio.ensure_future(admit(controller))
+        await asyncio.sleep(0)
+        assert controller.snapshot()["waiting"] == 1
+
+        with pytest.raises(HTTPException) as rejected:
+            await admit(controller)
+        assert rejected.value.status_code == 503
+        assert int(rejected.value.headers["Retry-After"]) >= 1
+
+        # Releasing the slot admits the queued request
+        await holder.aclose()
+        await (await queued).aclose()
+        return controller.snapshot()
+
+    snapshot = asyncio.run(run())
+    assert snapshot["admitted"] == 2
+    assert snapshot["rejected_queue_full"] == 1
+    assert snapshot["in_flight"] == 0
+
+
+def reject_time(controller, seconds_left, hold):
+    """Seconds until a request queued behind a held slot is rejected"""
+    async def run():
+        holder = await admit(controller)
+        controller._avg_hold = hold
+        set_deadline(seconds_left)  # only for this run's context
+        start = time.monotonic()
+        with pytest.raises(HTTPException) as rejected:
+            await admit(controller)
+        elapsed = time.monotonic() - start
+        await holder.aclose()
+        return elapsed, rejected.value
+
+    elapsed, error = asyncio.run(run())
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+    assert controller.snapshot()["waiting"] == 0
+    return elapsed
+
+
+def test_request_that_would_miss_its_deadline_is_rejected_right_away():
+    controller = AdmissionController("test", max_concurrent=1, max_queue=5)
+    # Slots are held ~30s and we have 10s: no point queueing at all
+    assert reject_time(controller, seconds_left=10.0, hold=30.0) < 0.1
+    assert controller.stats["rejected_deadline"] == 1
+
+
+def test_queue_wait_is_capped_to_a_fraction_of_the_time_left():
+    controller = AdmissionController("test", max_concurrent=1, max_queue=5, max_queue_wait_fraction=0.05)
+    # The estimate looks fine but the slot is never released
+    elapsed = reject_time(controller, seconds_left=4.0, hold=0.1)
+    assert 0.15 < elapsed < 0.5
+
+
+def test_request_with_too_little_time_left_is_not_admitted():
+    async def run():
+        controller = AdmissionController("test", max_concurrent=4, max_queue=5, min_time_left=2.0)
+        set_deadline(1.0)
+        with pytest.raises(HTTPException) as rejected:
+            await admit(controller)
+        return controller.snapshot(), rejected.value
+
+    snapshot, error = asyncio.run(run())
+    assert error.status_code == 503
+    assert snapshot["admitted"] == 0
+    assert snapshot["in_flight"] == 0
@@ -0,0 +1,107 @@
+"""
+Deck listing and export: keyset pages walk the whole deck exactly once,
+`fields` projects columns, and the streamed NDJSON/CSV export holds every
+word even when it spans several fetch batches and output chunks.
+"""
+import csv
+import io
+import json
+
+import pytest
+
+import deck
+
+
+@pytest.fixture
+def deck_of_25(client, auth_headers, fake_llm):
+    """25 words for our user, and a few for someone else that must never show up"""
+    fake_llm.words_per_call = 5
+    for _ in range(5):
+        client.post("/generate", json={}, headers=auth_headers)
+
+    other = client.post("/signup", json={"email": "other@test.com", "password": "test123"}).json()
+    client.post("/generate", json={}, headers={"Authorization": f"Bearer {other['access_token']}"})
+    return auth_headers
+
+
+def walk(client, headers, limit, **params):
+    items, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, limit=limit)
+        if cursor is not None:
+            query["cursor"] = cursor
+        response = client.get("/words", params=query, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        items += page["items"]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+
+@pytest.mark.parametrize("limit", [1, 4, 5, 25, 100])
+def test_pages_cover_the_deck_without_duplicates_or_gaps(client, deck_of_25, limit):
+    items, pages = walk(client, deck_of_25, limit)
+
+    ids = [item["id"] for item in items]
+    assert len(ids) == 25
+    assert ids == sorted(set(ids))
+    assert pages == max(1, -(-25 // limit))
+
+
+def test_cursor_past_the_end_is_an_empty_last_page(client, deck_of_25):
+    last_id = walk(client, deck_of_25, 100)[0][-1]["id"]
+    page = client.get("/words", params={"cursor": last_id}, headers=deck_of_25).json()
+    assert page == {"items": [], "next_cursor": None}
+
+
+@pytest.mark.parametrize("limit", [0, deck.MAX_PAGE_SIZE + 1])
+def test_page_size_is_bounded(client, deck_of_25, limit):
+    assert client.get("/words", params={"limit": limit}, headers=deck_of_25).status_code == 422
+
+
+def test_fields_projection(client, deck_of_25):
+    page = client.get("/words", params={"fields": "jp_word, status", "limit": 3}, headers=deck_of_25).json()
+    assert [set(item) for item in page["items"]] == [{"jp_word", "status"}] * 3
+
+
+@pytest.mark.parametrize("path", ["/words", "/words/export"])
+def test_unknown_field_is_rejected(client, deck_of_25, path):
+    response = client.get(path, params={"fields": "jp_word,password"}, headers=deck_of_25)
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    # Force several fetch batches and output chunks out of a 25-word deck
+    monkeypatch.setattr(deck, "EXPORT_BATCH_SIZE", 7)
+    monkeypatch.setattr(deck, "CHUNK_SIZE", 200)
+
+
+def test_ndjson_export(client, deck_of_25, small_batches):
+    response = client.get("/words/export", headers=deck_of_25)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'filename="words.ndjson"' in response.headers["content-disposition"]
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [item["id"] for item in walk(client, deck_of_25, 100)[0]]
+    assert set(rows[0]) == set(deck.DEFAULT_FIELDS)
+
+
+def test_csv_export_with_fields(client, deck_of_25, small_batches):
+    response = client.get("/words/export", params={"format": "csv", "fields": "id,jp_word"}, headers=deck_of_25)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="words.csv"' in response.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "jp_word"]
+    assert len(rows) == 26
+    assert len({row[0] for row in rows[1:]}) == 25
+
+
+def test_unknown_export_format_is_rejected(client, deck_of_25):
+    assert client.get("/words/export", params={"format": "xml"}, headers=deck_of_25).status_code == 422
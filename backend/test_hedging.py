@@ -0,0 +1,77 @@
+"""
+Hedged image lookups: the first usable provider wins, and cancelling the
+loser must not leave its circuit breaker stuck.
+"""
+import asyncio
+
+import pytest
+
+import image_providers
+from circuit_breaker import CircuitBreaker, HALF_OPEN
+from hedging import HedgePolicy, hedged
+
+
+class FakeResponse:
+    content = b"image"
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"photos": [{"src": {"medium": "https://images.pexels.com/apple.jpeg"}}]}
+
+
+class FakeAsyncClient:
+    """Pexels hangs, Pollinations answers right away"""
+
+    def __init__(self, timeout=None):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def get(self, url, headers=None):
+        if "pexels" in url:
+            await asyncio.sleep(60)
+        return FakeResponse()
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    monkeypatch.setenv("PEXELS_API_KEY", "test-key")
+    monkeypatch.setattr(image_providers.httpx, "AsyncClient", FakeAsyncClient)
+    fresh = {name: CircuitBreaker(name=name, min_requests=1) for name in image_providers.breakers}
+    monkeypatch.setattr(image_providers, "breakers", fresh)
+    return fresh
+
+
+def fetch_hedged(term="apple"):
+    policy = HedgePolicy(default_delay=0.01)
+    return asyncio.run(hedged(
+        lambda: image_providers._from_pexels(term),
+        lambda: image_providers._from_pollinations(term),
+        policy,
+    )), policy
+
+
+def test_slow_primary_is_hedged(providers):
+    (url, source, content), policy = fetch_hedged()
+
+    assert source == "Pollinations.ai"
+    assert content == b"image"
+    assert policy.snapshot()["hedge_wins"] == 1
+
+
+def test_cancelled_half_open_probe_is_released(providers):
+    breaker = providers["pexels_search"]
+    breaker._state = HALF_OPEN
+
+    (_, source, _), _ = fetch_hedged()
+
+    # The Pexels probe lost the hedge and was cancelled; the next call may probe again
+    assert source == "Pollinations.ai"
+    assert breaker.snapshot()["state"] == HALF_OPEN
+    assert breaker.allow_request()
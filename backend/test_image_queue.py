@@ -0,0 +1,157 @@
+"""
+Background image pre-resolution: failed lookups are retried with backoff
+until IMAGE_PREFETCH_MAX_ATTEMPTS, and dropped jobs are swept back in.
+"""
+import asyncio
+
+import pytest
+
+import image_providers
+import image_queue
+from circuit_breaker import CircuitBreaker
+from database import Base, SessionLocal, engine
+from image_queue import ImagePrefetchQueue
+from models import ImageJob, Word
+
+
+@pytest.fixture
+def word_id():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    word = Word(jp_word="りんご", reading="りんご", romaji="ringo", english="apple", image_search_term="apple")
+    db.add(word)
+    db.commit()
+    word_id = word.id
+    db.add(ImageJob(word_id=word_id))
+    db.commit()
+    db.close()
+    return word_id
+
+
+@pytest.fixture
+def flaky_fetch(monkeypatch):
+    """Fails `failures` times, then returns an image"""
+    calls = {"count": 0, "failures": 0}
+
+    async def resolve_image_url(search_term):
+        calls["count"] += 1
+        if calls["count"] <= calls["failures"]:
+            raise RuntimeError("provider down")
+        return "https://images.pexels.com/apple.jpeg", "Pexels"
+
+    monkeypatch.setattr(image_queue, "resolve_image_url", resolve_image_url)
+    monkeypatch.setattr(image_queue, "RETRY_BASE_SECONDS", 0.01)
+    return calls
+
+
+async def run_until(queue, done, seconds=1.0):
+    for _ in range(int(seconds / 0.01)):
+        await asyncio.sleep(0.01)
+        if done(queue.stats) and not queue._queued:
+            break
+    snapshot = queue.snapshot()
+    await queue.stop()
+    return snapshot
+
+
+def load(word_id):
+    db = SessionLocal()
+    try:
+        return db.get(Word, word_id), db.get(ImageJob, word_id)
+    finally:
+        db.close()
+
+
+def test_failed_lookup_is_retried_with_backoff(word_id, flaky_fetch):
+    flaky_fetch["failures"] = 2
+
+    async def run():
+        queue = ImagePrefetchQueue(concurrency=1)
+        queue.enqueue([word_id])
+        return await run_until(queue, lambda stats: stats["resolved"])
+
+    snapshot = asyncio.run(run())
+    word, job = load(word_id)
+    assert flaky_fetch["count"] == 3
+    assert snapshot["retried"] == 2
+    assert word.image_path == "https://images.pexels.com/apple.jpeg"
+    assert job is None
+
+
+def test_gives_up_after_max_attempts(word_id, flaky_fetch, monkeypatch):
+    monkeypatch.setattr(image_queue, "MAX_ATTEMPTS", 2)
+    flaky_fetch["failures"] = 10
+
+    async def run():
+        queue = ImagePrefetchQueue(concurrency=1)
+        queue.enqueue([word_id])
+        snapshot = await run_until(queue, lambda stats: stats["failed"] == 2)
+        assert snapshot["waiting_to_retry"] == 0
+        return snapshot
+
+    snapshot = asyncio.run(run())
+    word, job = load(word_id)
+    assert flaky_fetch["count"] == 2
+    assert snapshot["failed"] == 2
+    assert word.image_path is None
+    assert job.attempts == 2
+
+
+def test_sweep_picks_up_dropped_jobs(word_id, flaky_fetch, monkeypatch):
+    monkeypatch.setattr(image_queue, "SWEEP_INTERVAL", 0.01)
+
+    async def run():
+        queue = ImagePrefetchQueue(concurrency=1, maxsize=1)
+        queue._ensure_started()
+        queue._queue.put_nowait(-1)  # fill the queue so our job is dropped
+        queue.enqueue([word_id])
+        assert queue.stats["dropped"] == 1
+        sweep = asyncio.create_task(queue.sweep_periodically())
+        try:
+            return await run_until(queue, lambda stats: stats["resolved"])
+        finally:
+            sweep.cancel()
+
+    asyncio.run(run())
+    word, job = load(word_id)
+    assert word.image_path == "https://images.pexels.com/apple.jpeg"
+    assert job is None
+
+
+class RecordingAsyncClient:
+    """Records every URL requested; Pexels search finds one photo"""
+
+    urls = []
+
+    def __init__(self, timeout=None):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def get(self, url, headers=None):
+        self.urls.append(url)
+        return self
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"photos": [{"src": {"medium": "https://images.pexels.com/apple.jpeg"}}]}
+
+
+def test_background_resolution_does_not_download_pexels_images(monkeypatch):
+    monkeypatch.setenv("PEXELS_API_KEY", "test-key")
+    monkeypatch.setattr(image_providers.httpx, "AsyncClient", RecordingAsyncClient)
+    monkeypatch.setattr(RecordingAsyncClient, "urls", [])
+    monkeypatch.setattr(image_providers, "breakers", {name: CircuitBreaker(name=name) for name in image_providers.breakers})
+
+    url, source = asyncio.run(image_providers.resolve_image_url("apple"))
+
+    assert (url, source) == ("https://images.pexels.com/apple.jpeg", "Pexels")
+    assert len(RecordingAsyncClient.urls) == 1
+    assert RecordingAsyncClient.urls[0].startswith("https://api.pexels.com/v1/search")
@@ -0,0 +1,82 @@
+"""
+Micro-batching of word generation: how a batch's words are split among its
+users, and how users are grouped so every prompt lists their known words.
+"""
+import asyncio
+import json
+import re
+
+from llm_batcher import WordBatcher, _Waiter
+from main import WordResponse
+
+
+def word(jp):
+    return {"jp_word": jp, "reading": jp, "romaji": jp, "english": jp, "image_search_term": jp}
+
+
+def waiter(excluded=(), count=3):
+    return _Waiter(excluded=set(excluded), count=count, future=None, deadline=None)
+
+
+class RecordingLLM:
+    """Answers every prompt with `words` and records the prompts it saw"""
+
+    def __init__(self, words):
+        self.words = words
+        self.prompts = []
+
+    def __call__(self, prompt, timeout=None):
+        self.prompts.append(prompt)
+        return json.dumps({"words": self.words})
+
+
+def excluded_in(prompt):
+    return set(re.findall(r"'([^']*)'", prompt.split("NOT in this list:")[1].split("\n")[0]))
+
+
+def test_split_prefers_distinct_words_and_skips_known_ones():
+    words = [word(w) for w in ("a", "b", "c", "d", "e")]
+    alice, bob = waiter(excluded={"a"}, count=2), waiter(count=2)
+
+    assigned = WordBatcher._split([alice, bob], words)
+
+    assert [w["jp_word"] for w in assigned[0]] == ["b", "c"]
+    assert [w["jp_word"] for w in assigned[1]] == ["a", "d"]
+
+
+def test_split_shares_words_only_to_fill_gaps():
+    words = [word(w) for w in ("a", "b", "c")]
+    alice, bob = waiter(count=2), waiter(excluded={"c"}, count=2)
+
+    assigned = WordBatcher._split([alice, bob], words)
+
+    assert [w["jp_word"] for w in assigned[0]] == ["a", "b"]
+    assert [w["jp_word"] for w in assigned[1]] == ["a", "b"]
+
+
+def test_large_decks_get_their_own_completion():
+    batcher = WordBatcher(RecordingLLM([]), WordResponse, max_excluded=5)
+    small_a, small_b = waiter(excluded={"a", "b"}), waiter(excluded={"c", "d"})
+    large = waiter(excluded={f"w{i}" for i in range(10)})
+    overflow = waiter(excluded={"e", "f"})
+
+    groups = batcher._groups([small_a, large, small_b, overflow])
+
+    assert groups == [[large], [small_a, small_b], [overflow]]
+
+
+def test_every_waiter_sees_all_of_its_exclusions():
+    llm = RecordingLLM([word(f"new{i}") for i in range(12)])
+    batcher = WordBatcher(llm, WordResponse, max_batch_size=3, max_wait_ms=1000, max_excluded=5)
+    decks = [{"a", "b"}, {"c", "d"}, {f"known{i}" for i in range(8)}]
+
+    async def run():
+        return await asyncio.gather(*(batcher.generate(sorted(deck), 3) for deck in decks))
+
+    results = asyncio.run(run())
+
+    assert [len(words) for words in results] == [3, 3, 3]
+    assert len(llm.prompts) == 2
+    prompts = [excluded_in(prompt) for prompt in llm.prompts]
+    for deck in decks:
+        assert any(deck <= excluded for excluded in prompts)
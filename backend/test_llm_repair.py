@@ -0,0 +1,96 @@
+"""
+Item-level validation and repair of generated words: malformed items are
+dropped and only the missing count is requested again.
+"""
+import asyncio
+import json
+import re
+
+from llm_batcher import WordBatcher
+from main import WordResponse
+
+
+def word(i):
+    return {
+        "jp_word": f"単語{i}",
+        "reading": f"たんご{i}",
+        "romaji": f"tango{i}",
+        "english": f"word {i}",
+        "image_search_term": f"thing {i}",
+    }
+
+
+class ScriptedLLM:
+    """Returns the queued responses in order and records the requested counts"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requested_counts = []
+
+    def __call__(self, prompt, timeout=None):
+        self.requested_counts.append(int(re.search(r"Generate (\d+)", prompt).group(1)))
+        return self.responses.pop(0)
+
+
+def generate(llm, count=3):
+    batcher = WordBatcher(llm, WordResponse, max_batch_size=1, max_wait_ms=0)
+    return asyncio.run(batcher.generate([], count)), batcher
+
+
+def test_partial_item_is_repaired_with_small_follow_up():
+    broken = {k: v for k, v in word(1).items() if k != "romaji"}
+    llm = ScriptedLLM(
+        json.dumps({"words": [word(0), broken, word(2)]}),
+        json.dumps({"words": [word(3)]}),
+    )
+    words, batcher = generate(llm)
+
+    assert [w["jp_word"] for w in words] == ["単語0", "単語2", "単語3"]
+    assert llm.requested_counts == [3, 1]
+    assert batcher.stats["items_invalid"] == 1
+    assert batcher.stats["repair_calls"] == 1
+    assert batcher.stats["words_repaired"] == 1
+
+
+def test_malformed_json_does_not_fail_the_request():
+    llm = ScriptedLLM('{"words": [{"jp_word": "単語0", ', json.dumps({"words": [word(0), word(1), word(2)]}))
+    words, batcher = generate(llm)
+
+    assert len(words) == 3
+    assert batcher.stats["malformed_responses"] == 1
+    assert batcher.stats["errors"] == 0
+
+
+def test_empty_content_is_repaired_instead_of_hanging():
+    # A refusal comes back with content=None
+    llm = ScriptedLLM(None, json.dumps({"words": [word(0), word(1), word(2)]}))
+    words, batcher = generate(llm)
+
+    assert len(words) == 3
+    assert llm.requested_counts == [3, 3]
+    assert batcher.stats["malformed_responses"] == 1
+
+
+def test_waiters_are_answered_when_splitting_fails(monkeypatch):
+    def broken_split(batch, words):
+        raise RuntimeError("split failed")
+
+    llm = ScriptedLLM(json.dumps({"words": [word(0)]}), json.dumps({"words": [word(1)]}))
+    batcher = WordBatcher(llm, WordResponse, max_batch_size=1, max_wait_ms=0)
+    monkeypatch.setattr(batcher, "_split", broken_split)
+
+    # No request deadline here, so a lost waiter would hang forever
+    words = asyncio.run(asyncio.wait_for(batcher.generate([], 3), timeout=5))
+
+    assert words == []
+    assert batcher.stats["errors"] == 2
+    assert batcher.stats["short_after_repair"] == 1
+
+
+def test_returns_what_it_has_when_repairs_run_out():
+    llm = ScriptedLLM(json.dumps({"words": [word(0), "not an object"]}), json.dumps({"words": []}))
+    words, batcher = generate(llm)
+
+    assert [w["jp_word"] for w in words] == ["単語0"]
+    assert batcher.stats["short_after_repair"] == 1
+    assert batcher.snapshot()["item_failure_rate"] == 0.5
@@ -0,0 +1,130 @@
+"""
+Opt-in request profiling: admin tokens, the middleware's trigger and
+X-Profile-Id header, the stored summary and SQL log, pruning, and the
+download endpoint's filename guard.
+"""
+import json
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import profiling
+from database import engine
+
+SECRET = "test-secret"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def sql_logging():
+    profiling.install_sql_logging(engine)
+
+
+@pytest.fixture
+def profiled(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "SECRET", SECRET)
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    app = FastAPI()
+    app.add_middleware(profiling.ProfilingMiddleware)
+    app.include_router(profiling.router)
+
+    @app.get("/work")
+    async def work():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1")).scalar()
+            conn.execute(text("SELECT 2")).scalar()
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def admin():
+    return {"X-Profile-Token": profiling.make_token(SECRET)}
+
+
+def test_verify_token(monkeypatch):
+    monkeypatch.setattr(profiling, "SECRET", SECRET)
+    now = int(time.time())
+
+    assert profiling.verify_token(profiling.make_token(SECRET, now))
+    assert not profiling.verify_token(profiling.make_token(SECRET, now - profiling.TOKEN_MAX_AGE - 1))
+    assert not profiling.verify_token(profiling.make_token("wrong-secret", now))
+    assert not profiling.verify_token(str(now))
+    assert not profiling.verify_token(f"soon:{profiling.make_token(SECRET, now).split(':')[1]}")
+    assert not profiling.verify_token(None)
+
+    monkeypatch.setattr(profiling, "SECRET", "")
+    assert not profiling.verify_token(profiling.make_token("", now))
+
+
+def test_unprofiled_requests_are_left_alone(profiled, tmp_path):
+    response = profiled.get("/work")
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+    bad = profiled.get("/work", headers={"X-Profile-Token": profiling.make_token("wrong-secret")})
+    assert "x-profile-id" not in bad.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_one_request_and_download_it(profiled):
+    response = profiled.get("/work", headers=admin())
+    profile_id = response.headers["x-profile-id"]
+
+    listing = profiled.get("/profiles", headers=admin()).json()["profiles"]
+    assert [p["id"] for p in listing] == [profile_id]
+    assert listing[0]["path"] == "/work"
+    assert listing[0]["status"] == 200
+
+    summary = profiled.get(f"/profiles/{profile_id}.json", headers=admin()).json()
+    statements = [entry["statement"] for entry in summary["sql"]["log"]]
+    assert statements == ["SELECT 1", "SELECT 2"]
+    assert summary["sql"]["count"] == 2
+    assert summary["mode"] == "wall"
+    assert "function calls" in summary["top_functions"]
+
+    prof = profiled.get(f"/profiles/{profile_id}.prof", headers=admin())
+    assert prof.status_code == 200
+    assert len(prof.content) > 0
+
+
+def test_cpu_mode(profiled):
+    response = profiled.get("/work", headers={**admin(), "X-Profile-Mode": "cpu"})
+    summary = profiled.get(f"/profiles/{response.headers['x-profile-id']}.json", headers=admin()).json()
+    assert summary["mode"] == "cpu"
+
+
+def test_old_profiles_are_pruned(profiled, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "MAX_PROFILES", 2)
+    ids = []
+    for i in range(4):
+        ids.append(profiled.get("/work", headers=admin()).headers["x-profile-id"])
+        # mtime orders the profiles; keep it distinct on coarse filesystems
+        for ext in (".json", ".prof"):
+            path = tmp_path / f"{ids[-1]}{ext}"
+            os.utime(path, (1000 + i, 1000 + i))
+
+    profiling._prune_old_profiles()
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        f"{profile_id}{ext}" for profile_id in ids[-2:] for ext in (".json", ".prof")
+    )
+
+
+@pytest.mark.parametrize("filename", ["secrets.txt", "a-b.json", "..json", "x.json.bak", "missing.json"])
+def test_download_only_serves_profile_files(profiled, tmp_path, filename):
+    (tmp_path / "secrets.txt").write_text("nope")
+    (tmp_path / "a-b.json").write_text("{}")
+    assert profiled.get(f"/profiles/{filename}", headers=admin()).status_code == 404
+
+
+def test_profiles_need_the_admin_token(profiled):
+    profile_id = profiled.get("/work", headers=admin()).headers["x-profile-id"]
+    assert profiled.get("/profiles").status_code == 403
+    assert profiled.get(f"/profiles/{profile_id}.json").status_code == 403
+    stale = {"X-Profile-Token": profiling.make_token(SECRET, int(time.time()) - 3600)}
+    assert profiled.get(f"/profiles/{profile_id}.json", headers=stale).status_code == 403
@@ -0,0 +1,137 @@
+"""
+Query budgets per endpoint.
+
+Each endpoint has a declared maximum number of SQL statements per request
+(auth included). The generation endpoints must also stay flat as the number
+of words grows, so an N+1 creeping back in fails here before it reaches
+production. Runs on SQLite with OpenAI and the image providers stubbed
+(see conftest.py).
+"""
+import pytest
+
+# Statements per request, including get_current_user's lookup.
+#
+# /generate and /cards (the same 7 whatever the number of words):
+#   1. SELECT the user (auth)
+#   2. SELECT the user's known words, to exclude them from the prompt
+#   3. INSERT the returned words, ON CONFLICT (jp_word) DO NOTHING
+#   4. SELECT those words back, new and existing, for their ids
+#   5. INSERT the user_words links
+#   6. UPDATE the user_stats counters
+#   7. INSERT the image_jobs for words without an image, ON CONFLICT DO NOTHING
+# 2 has to run before the LLM call and 3-7 after it, and an insert can't
+# return rows it skipped on conflict, so 4 stays separate.
+QUERY_BUDGETS = {
+    "POST /generate": 7,
+    "POST /cards": 7,
+    "POST /generate-image (cache miss)": 3,
+    "POST /generate-image (cache hit)": 2,
+    "GET /cards/images": 1,
+    "GET /images/{word_id} (pending)": 1,
+    "GET /images/{word_id} (cached)": 1,
+    "GET /words": 2,
+    "GET /stats": 3,
+    "PATCH /words/{id}": 4,
+}
+
+
+def assert_within_budget(name, statements):
+    budget = QUERY_BUDGETS[name]
+    assert len(statements) <= budget, (
+        f"{name} ran {len(statements)} queries, budget is {budget}:\n" + "\n".join(statements)
+    )
+
+
+@pytest.fixture
+def warmed_up(client, auth_headers):
+    # The first generation creates the user's stats row; budgets are for steady state
+    client.post("/generate", json={}, headers=auth_headers)
+    return auth_headers
+
+
+@pytest.mark.parametrize("endpoint", ["/generate", "/cards"])
+def test_generation_query_count_is_flat(client, warmed_up, fake_llm, count_queries, endpoint):
+    counts = {}
+    for words_per_call in (1, 3, 10):
+        fake_llm.words_per_call = words_per_call
+        with count_queries() as statements:
+            response = client.post(endpoint, json={}, headers=warmed_up)
+        assert response.status_code == 200
+        assert_within_budget(f"POST {endpoint}", statements)
+        counts[words_per_call] = len(statements)
+
+    assert len(set(counts.values())) == 1, f"Query count grows with batch size: {counts}"
+
+
+def test_generate_image_budget(client, warmed_up, count_queries, fake_images):
+    card = client.post("/cards", headers=warmed_up).json()["cards"][0]
+    request = {"word": card["jp_word"], "english_meaning": card["image_search_term"]}
+
+    with count_queries() as statements:
+        assert client.post("/generate-image", json=request, headers=warmed_up).status_code == 200
+    assert_within_budget("POST /generate-image (cache miss)", statements)
+    assert fake_images["fetch"] == 1
+
+    with count_queries() as statements:
+        assert client.post("/generate-image", json=request, headers=warmed_up).status_code == 200
+    assert_within_budget("POST /generate-image (cache hit)", statements)
+    assert fake_images["fetch"] == 1
+
+
+def test_card_image_budgets(client, warmed_up, fake_llm, fake_images, count_queries):
+    fake_llm.words_per_call = 10
+    cards = client.post("/cards", headers=warmed_up).json()["cards"]
+    word_ids = [card["word_id"] for card in cards]
+
+    with count_queries() as statements:
+        response = client.get("/cards/images", params={"word_ids": word_ids})
+    assert len(response.json()["images"]) == 10
+    assert_within_budget("GET /cards/images", statements)
+
+    # Prefetch is stubbed out, so the image is still pending; the public
+    # endpoint must not resolve it
+    with count_queries() as statements:
+        response = client.get(f"/images/{word_ids[0]}")
+    assert response.status_code == 404
+    assert_within_budget("GET /images/{word_id} (pending)", statements)
+    assert fake_images["fetch"] == 0
+
+    request = {"word": cards[0]["jp_word"], "english_meaning": cards[0]["image_search_term"]}
+    assert client.post("/generate-image", json=request, headers=warmed_up).status_code == 200
+
+    with count_queries() as statements:
+        response = client.get(f"/images/{word_ids[0]}")
+    assert response.status_code == 200
+    assert_within_budget("GET /images/{word_id} (cached)", statements)
+
+    with count_queries() as statements:
+        response = client.get(f"/images/{word_ids[0]}", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert_within_budget("GET /images/{word_id} (cached)", statements)
+
+
+def test_deck_and_stats_budgets(client, warmed_up, fake_llm, count_queries):
+    fake_llm.words_per_call = 10
+    for _ in range(3):
+        client.post("/generate", json={}, headers=warmed_up)
+
+    # A deep page costs the same as the first one
+    cursor = None
+    while True:
+        params = {"limit": 5} if cursor is None else {"limit": 5, "cursor": cursor}
+        with count_queries() as statements:
+            page = client.get("/words", params=params, headers=warmed_up).json()
+        assert_within_budget("GET /words", statements)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    with count_queries() as statements:
+        assert client.patch("/words/1", json={"status": "learning"}, headers=warmed_up).status_code == 200
+    assert_within_budget("PATCH /words/{id}", statements)
+
+    with count_queries() as statements:
+        stats = client.get("/stats", headers=warmed_up).json()
+    assert_within_budget("GET /stats", statements)
+    assert stats["total"] == 33
+    assert stats["learning"] == 1
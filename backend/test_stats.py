@@ -0,0 +1,43 @@
+"""
+Progress counters: reconciliation recounts from user_words and fixes drift,
+and the due count is answered from its index alone.
+"""
+import datetime
+
+from sqlalchemy import text
+
+import stats
+from database import SessionLocal, engine
+from models import UserStats
+
+
+def test_reconcile_fixes_drift(client, auth_headers):
+    client.post("/generate", json={}, headers=auth_headers)
+    db = SessionLocal()
+    db.query(UserStats).update({UserStats.new_count: 42})
+    db.commit()
+    db.close()
+
+    assert stats.reconcile_all() == 1
+    assert stats.reconcile_all() == 0
+    assert client.get("/stats", headers=auth_headers).json()["new"] == 3
+
+
+def test_due_today_skips_mastered_and_future_words(client, auth_headers):
+    client.post("/generate", json={}, headers=auth_headers)
+    client.patch("/words/1", json={"status": "mastered"}, headers=auth_headers)
+    db = SessionLocal()
+    db.execute(text("UPDATE user_words SET next_review_date = :later WHERE id = 2"),
+               {"later": datetime.datetime.utcnow() + datetime.timedelta(days=3)})
+    db.commit()
+    db.close()
+
+    assert client.get("/stats", headers=auth_headers).json()["due_today"] == 1
+
+
+def test_due_count_uses_a_covering_index(client):
+    stmt = stats.due_count_query(1, datetime.datetime(2030, 1, 1))
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    assert "COVERING INDEX ix_user_words_user_id_status_next_review_date" in plan
@@ -0,0 +1,84 @@
+"""
+Linking generated words when concurrent requests get the same new word:
+the batcher hands shared words to several users on purpose, and another
+process may insert a word between our generation and our insert.
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from sqlalchemy import event, func
+
+import main
+from database import SessionLocal, engine
+from llm_batcher import WordBatcher
+from models import UserWord, Word
+
+
+def word(jp):
+    return {"jp_word": jp, "reading": jp, "romaji": jp, "english": jp, "image_search_term": jp}
+
+
+SHARED_WORDS = [word(jp) for jp in ("ねこ", "いぬ", "とり")]
+
+
+@pytest.fixture
+def shared_batcher(monkeypatch):
+    """Both users' requests land in one batch that only has three words to share"""
+    batcher = WordBatcher(
+        lambda prompt, timeout=None: json.dumps({"words": SHARED_WORDS}),
+        main.WordResponse,
+        max_batch_size=2,
+        max_wait_ms=1000,
+        max_repairs=0,
+    )
+    monkeypatch.setattr(main, "word_batcher", batcher)
+    return batcher
+
+
+@pytest.fixture
+def concurrent_insert():
+    """Another process commits the first shared word right before our INSERT INTO words"""
+    state = {"done": False}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if state["done"] or not statement.startswith("INSERT INTO words"):
+            return
+        state["done"] = True
+        with engine.connect() as other:
+            other.execute(Word.__table__.insert().values(**SHARED_WORDS[0]))
+            other.commit()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield state
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def signup(client, email):
+    token = client.post("/signup", json={"email": email, "password": "test123"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_two_waiters_sharing_new_words(client, shared_batcher, concurrent_insert):
+    users = [signup(client, "cat@test.com"), signup(client, "dog@test.com")]
+
+    async def generate_both():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+            return await asyncio.gather(*(api.post("/generate", json={}, headers=h) for h in users))
+
+    responses = asyncio.run(generate_both())
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert concurrent_insert["done"]
+    assert shared_batcher.stats["batches"] == 1
+    for response in responses:
+        assert [w["jp_word"] for w in response.json()["words"]] == ["ねこ", "いぬ", "とり"]
+
+    db = SessionLocal()
+    try:
+        assert db.query(func.count(Word.id)).scalar() == 3
+        assert db.query(func.count(UserWord.id)).scalar() == 6
+    finally:
+        db.close()